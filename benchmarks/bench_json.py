@@ -0,0 +1,54 @@
+# coding=utf-8
+"""Compare the JSON backends of flask_seed.utils.dumps.
+
+    python benchmarks/bench_json.py [documents] [rounds]
+"""
+
+import sys
+import timeit
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from bson import ObjectId, Decimal128, json_util
+
+from flask_seed import utils
+
+
+def make_documents(number):
+    created = datetime(2016, 1, 1)
+    return [{
+        '_id': i,
+        'oid': ObjectId(),
+        'name': 'customer {}'.format(i),
+        'number': 'C{:0>8}'.format(i),
+        'user_id': i % 97,
+        'active': i % 3 != 0,
+        'balance': Decimal128(Decimal('{}.25'.format(i))),
+        'score': i / 7.0,
+        'tags': ['tag{}'.format(i % 5), 'tag{}'.format(i % 11)],
+        'address': {'city': 'city {}'.format(i % 50),
+                    'zip': '{:0>6}'.format(i)},
+        'created': created + timedelta(minutes=i),
+    } for i in range(number)]
+
+
+def main(number=10000, rounds=5):
+    documents = make_documents(number)
+    expected = json_util.loads(utils.JSON_BACKENDS['json_util'](documents))
+    print('{} documents, best of {} rounds'.format(number, rounds))
+    for name in sorted(utils.JSON_BACKENDS):
+        try:
+            utils.set_json_backend(name)
+        except RuntimeError as e:
+            print('{:<10} skipped, {}'.format(name, e))
+            continue
+        assert json_util.loads(utils.dumps(documents)) == expected, name
+        best = min(timeit.repeat(lambda: utils.dumps(documents),
+                                 number=1, repeat=rounds))
+        print('{:<10} {:>8.1f} ms {:>10.0f} docs/s'.format(
+            name, best * 1000, number / best))
+    utils.set_json_backend('json_util')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,111 @@
+# coding=utf-8
+"""Hammer MongoDriver.get_serial_numbers and check no serial repeats.
+
+Needs a MongoDB server; MONGO_URI defaults to a scratch database on
+localhost, which is dropped first. With --mongomock (pip install
+mongomock) threads of a single process share an in-memory database
+instead, which runs anywhere; a legacy todo_serial_number document of
+today is inserted first, and no serial may be at or below it.
+
+    python benchmarks/stress_serial.py [processes] [threads] [calls] [block]
+    python benchmarks/stress_serial.py --mongomock [threads] [calls] [block]
+"""
+
+import os
+import sys
+import threading
+from multiprocessing import Process, Queue
+from time import strftime
+
+from flask import Flask
+
+import flask_seed.drivers.mongo as mongo
+from flask_seed.drivers import MongoDriver
+
+LEGACY_ID = 57
+
+
+def make_driver(block_size):
+    app = Flask('stress_serial')
+    app.config['MONGO_URI'] = os.environ.get(
+        'MONGO_URI', 'mongodb://localhost:27017/flask_seed_stress')
+    app.config['MONGO_SERIAL_BLOCK_SIZE'] = block_size
+    return app, MongoDriver(app)
+
+
+def worker(threads, calls, block_size, results, app_driver=None):
+    app, driver = app_driver or make_driver(block_size)
+    serials = []
+
+    def run():
+        with app.app_context():
+            for _ in range(calls):
+                serials.extend(driver.get_serial_numbers())
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    results.put(serials)
+
+
+def check(serials, expected, lowest=0):
+    duplicates = len(serials) - len(set(serials))
+    early = sum(1 for serial in serials if int(serial[8:]) <= lowest)
+    print('{} serials, {} expected, {} duplicated, {} reissued'.format(
+        len(serials), expected, duplicates, early))
+    if duplicates or early or len(serials) != expected:
+        sys.exit(1)
+
+
+def main_mongomock(threads=8, calls=250, block_size=1):
+    import mongomock
+
+    mongo.MongoClient = mongomock.MongoClient
+    app, driver = make_driver(block_size)
+    with app.app_context():
+        driver.db.ids.insert_one(dict(name='todo_serial_number',
+                                      id=LEGACY_ID,
+                                      today=strftime(mongo.DAY_FORMAT)))
+    results = []
+    worker_results = Queue()
+    pool = [threading.Thread(target=worker,
+                             args=(1, calls, block_size, worker_results,
+                                   (app, driver)))
+            for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for _ in pool:
+        results.extend(worker_results.get())
+    for thread in pool:
+        thread.join()
+    check(results, threads * calls, LEGACY_ID)
+
+
+def main(processes=4, threads=8, calls=250, block_size=1):
+    app, driver = make_driver(block_size)
+    with app.app_context():
+        driver.cx.drop_database(driver.db)
+        driver.init_ids()
+
+    results = Queue()
+    pool = [Process(target=worker,
+                    args=(threads, calls, block_size, results))
+            for _ in range(processes)]
+    for process in pool:
+        process.start()
+    serials = []
+    for _ in pool:
+        serials.extend(results.get())
+    for process in pool:
+        process.join()
+
+    check(serials, processes * threads * calls)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--mongomock']:
+        main_mongomock(*[int(arg) for arg in sys.argv[2:5]])
+    else:
+        main(*[int(arg) for arg in sys.argv[1:5]])
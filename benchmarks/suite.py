@@ -0,0 +1,249 @@
+# coding=utf-8
+"""Offline benchmarks of the handler, driver, JSON and when hot paths.
+
+Mongo is replaced by mongomock (pip install mongomock), so no server is
+needed. mongomock scans whole collections, which is why the handler
+benchmarks keep them small; its share of the time stays the same from
+one run to the next, so changes still show. Every benchmark prints the
+best of ``--rounds`` rounds; ``--save`` writes them to a JSON file and
+``--compare`` fails with exit status 1 when a benchmark got slower than
+that baseline by more than ``--threshold`` (0.25 = 25%). Baselines only
+compare on the machine that recorded them.
+
+    python benchmarks/suite.py [--rounds 5] [--only list,get]
+        [--save baseline.json] [--compare baseline.json] [--threshold 0.25]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+import threading
+import timeit
+from datetime import date
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+from flask import Flask
+
+import flask_seed.drivers.mongo as mongo
+from flask_seed import Seed, BaseHandler, utils, when
+from flask_seed.drivers import MongoBase
+
+from bench_json import make_documents
+
+DOCUMENTS = 200
+BENCHMARKS = []
+
+
+def benchmark(name, ops):
+    """Register a benchmark doing ``ops`` operations per round.
+
+    The decorated function does the setup and returns the callable timed
+    in each round.
+    """
+    def register(func):
+        BENCHMARKS.append((name, ops, func))
+        return func
+
+    return register
+
+
+def make_app(documents=DOCUMENTS, **config):
+    mongo.MongoClient = mongomock.MongoClient
+
+    class Item(MongoBase):
+        __collection__ = 'items'
+
+    class ItemHandler(BaseHandler):
+        model = 'Item'
+        member = 'item'
+
+    app = Flask('bench')
+    app.config.update(SEED_DB_DRIVER='mongo', MONGO_DBNAME='bench',
+                      MONGO_ID_BLOCK_SIZE=100)
+    app.config.update(config)
+    seed = Seed(app)
+    seed.register_models([Item])
+    with app.app_context():
+        app.db_driver.init_db()
+        if documents:
+            app.db_driver.Item.bulk_create([
+                dict(name='item {}'.format(i), user_id=i % 97, active=True)
+                for i in range(documents)])
+    seed.register_handlers([ItemHandler])
+    return app
+
+
+@benchmark('list', 200)
+def bench_list(rounds):
+    client = make_app().test_client()
+
+    def run():
+        for page in range(200):
+            client.get('/items?per_page=20&page={}'.format(page % 10 + 1))
+
+    return run
+
+
+@benchmark('get', 1000)
+def bench_get(rounds):
+    client = make_app().test_client()
+
+    def run():
+        for i in range(1000):
+            client.get('/items/{}'.format(i % DOCUMENTS + 1))
+
+    return run
+
+
+@benchmark('create', 500)
+def bench_create(rounds):
+    client = make_app(documents=0).test_client()
+
+    def run():
+        for i in range(500):
+            client.post('/items', json=dict(name='new {}'.format(i)))
+
+    return run
+
+
+@benchmark('update', 500)
+def bench_update(rounds):
+    client = make_app().test_client()
+
+    def run():
+        for i in range(500):
+            client.post('/items/{}'.format(i % DOCUMENTS + 1),
+                        json=dict(active=False))
+
+    return run
+
+
+@benchmark('delete', 100)
+def bench_delete(rounds):
+    client = make_app(documents=100 * rounds).test_client()
+    ids = iter(range(1, 100 * rounds + 1))
+
+    def run():
+        for _ in range(100):
+            client.delete('/items/{}'.format(next(ids)))
+
+    return run
+
+
+@benchmark('dumps_10k', 10000)
+def bench_dumps(rounds):
+    documents = make_documents(10000)
+    return lambda: utils.dumps(documents)
+
+
+@benchmark('ids_8_threads', 8 * 500)
+def bench_ids(rounds):
+    app = make_app(documents=0)
+
+    def take(results):
+        with app.app_context():
+            for _ in range(500):
+                results.append(app.db_driver.get_id('items'))
+
+    def run():
+        results = []
+        threads = [threading.Thread(target=take, args=(results,))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(set(results)) == len(results), 'duplicate ids'
+
+    return run
+
+
+@benchmark('when_ranges', 1000)
+def bench_when(rounds):
+    day = when.Time(date(2016, 10, 18))
+
+    def run():
+        for _ in range(250):
+            day.get_recent_ranges('month', 12)
+            day.get_recent_ranges('quarter', 4)
+            day.get_recent_ranges('year', 3)
+            day.day_range()
+
+    return run
+
+
+def run_benchmarks(rounds=5, only=None):
+    results = {}
+    for name, ops, setup in BENCHMARKS:
+        if only and name not in only:
+            continue
+        try:
+            run = setup(rounds)
+            best = min(timeit.repeat(run, number=1, repeat=rounds))
+        except Exception as e:
+            print('{:<14} error: {!r}'.format(name, e))
+            results[name] = None
+            continue
+        results[name] = best / ops
+        print('{:<14} {:>10.1f} us/op {:>12.0f} ops/s'.format(
+            name, best / ops * 1e6, ops / best))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the change against ``baseline``, return the regressions."""
+    regressions = []
+    for name, seconds in sorted(results.items()):
+        before = baseline.get(name)
+        if seconds is None:
+            regressions.append(name)
+            continue
+        if not before:
+            continue
+        change = seconds / before - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('{:<14} {:>+8.1%}{}'.format(name, change, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--only', default='')
+    parser.add_argument('--save')
+    parser.add_argument('--compare')
+    parser.add_argument('--threshold', type=float, default=0.25)
+    args = parser.parse_args(argv)
+    if mongomock is None:
+        print('mongomock is needed: pip install mongomock')
+        return 2
+
+    only = [name for name in args.only.split(',') if name]
+    results = run_benchmarks(args.rounds, only)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print('against {}, threshold {:.0%}'.format(args.compare,
+                                                    args.threshold))
+        if compare(results, baseline, args.threshold):
+            status = 1
+    elif None in results.values():
+        status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
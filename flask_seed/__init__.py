@@ -3,24 +3,31 @@
 import logging
 from logging.handlers import RotatingFileHandler
 
-from gevent.wsgi import WSGIServer
 from werkzeug.serving import run_with_reloader
 from werkzeug.debug import DebuggedApplication
 
 from .exceptions import HTTPError, handle_http_error
 from .handlers import BaseHandler
+from .logs import AsyncHandler
+from .profiling import Profiler
 from .drivers import get_db_driver
+from .server import Server
+from .utils import set_json_backend
 
 
 class Seed(object):
 
     def __init__(self, app=None, config_prefix='SEED'):
         self.app = app
+        self.handlers = []
+        self.profiler = None
         if app is not None:
             self.init_app(app)
 
     def init_app(self, app, config_prefix='SEED'):
         self.app = app
+        self.config_prefix = config_prefix
+        app.extensions['seed'] = self
 
         # Custom HTTP Error
         app.errorhandler(HTTPError)(handle_http_error)
@@ -28,6 +35,9 @@ class Seed(object):
         def key(suffix):
             return '%s_%s' % (config_prefix, suffix)
 
+        # encoder behind utils.dumps and every handler response.
+        set_json_backend(app.config.get(key('JSON_BACKEND'), 'json_util'))
+
         # set database driver
         db_driver = app.config.get(key('DB_DRIVER'), None)
         if db_driver:
@@ -43,18 +53,72 @@ class Seed(object):
         if not getattr(app, 'db_driver', None):
             setattr(app, 'db_driver', self.db_driver)
 
-        # app logger add RotatingFileHandler.
+        # app logger add RotatingFileHandler, written from a background
+        # thread unless SEED_LOG_ASYNC is False.
         log_file = app.config.get(key('LOG_FILE'), None)
         if log_file:
+            log_level = app.config.get(key('LOG_LEVEL'), 'DEBUG')
             logger_handler = RotatingFileHandler(log_file)
-            logger_handler.setLevel(app.config.get(key('LOG_LEVEL'), 'DEBUG'))
+            logger_handler.setLevel(log_level)
             formatter = logging.Formatter(
                 '%(asctime)s %(levelname)s %(name)s %(message)s '
                 '[in %(pathname)s:%(lineno)d]')
             logger_handler.setFormatter(
                 app.config.get(key('LOG_FORMATTER'), formatter))
+            if app.config.get(key('LOG_ASYNC'), True):
+                logger_handler = AsyncHandler(
+                    logger_handler,
+                    maxsize=app.config.get(key('LOG_QUEUE_SIZE'), 10000),
+                    policy=app.config.get(key('LOG_QUEUE_POLICY'), 'drop'))
+                logger_handler.setLevel(log_level)
             app.logger.addHandler(logger_handler)
 
+        # per request stage timings, see flask_seed.profiling.Profiler.
+        if app.config.get(key('PROFILE'), False):
+            self.profiler = Profiler(app, config_prefix)
+
+    def after_fork(self):
+        after_fork = getattr(self.db_driver, 'after_fork', None)
+        if after_fork is not None:
+            with self.app.app_context():
+                after_fork()
+
+    def run(self, host=None, port=None, workers=None, **options):
+        """Serve the app with gevent in production.
+
+        Arguments not given are read from the ``SEED_SERVER_HOST``,
+        ``_PORT``, ``_WORKERS``, ``_BACKLOG``, ``_MAX_CONNECTIONS``,
+        ``_KEEPALIVE`` and ``_GRACEFUL_TIMEOUT`` config keys, see
+        :class:`~flask_seed.server.Server`. Database clients are rebuilt in
+        every worker after the fork. A debug app with a single worker runs
+        with werkzeug's debugger and reloader.
+        """
+        config = self.app.config
+
+        def key(suffix):
+            return '%s_SERVER_%s' % (self.config_prefix, suffix)
+
+        for name, default in (('backlog', 1024), ('max_connections', None),
+                              ('keepalive', True), ('graceful_timeout', 30)):
+            options.setdefault(name, config.get(key(name.upper()), default))
+        if host is None:
+            host = config.get(key('HOST'), '127.0.0.1')
+        if port is None:
+            port = config.get(key('PORT'), 5000)
+        if workers is None:
+            workers = config.get(key('WORKERS'), 1)
+
+        application = self.app
+        debug = self.app.debug and workers <= 1
+        if debug:
+            application = DebuggedApplication(self.app, evalex=True)
+        server = Server(application, host, int(port), int(workers),
+                        post_fork=[self.after_fork], **options)
+        if debug:
+            run_with_reloader(server.run)
+        else:
+            server.run()
+
     def register_models(self, models=None):
         # self.app.app_context().push()
         models = models or Models
@@ -65,7 +129,9 @@ class Seed(object):
         handlers = handlers or Handlers
         with self.app.app_context():
             for h in handlers:
-                self.app.register_blueprint(h().blueprint, **options)
+                handler = h()
+                self.handlers.append(handler)
+                self.app.register_blueprint(handler.blueprint, **options)
 
 
 class Set(object):
@@ -0,0 +1,111 @@
+# coding=utf-8
+
+import math
+import threading
+from collections import deque
+from timeit import default_timer
+
+from gevent.event import Event
+
+from .exceptions import HTTPServiceUnavailable, HTTPTooManyRequests
+
+
+class TokenBucket(object):
+    """Thread safe token bucket, ``rate`` tokens a second, at most
+    ``burst`` saved up."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self.tokens = self.burst
+        self.updated = default_timer()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Take a token, return 0 or the seconds until one is available."""
+        with self._lock:
+            now = default_timer()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+class Admission(object):
+    """Admit at most ``max_concurrent`` requests at once, ``rate`` a second.
+
+    Requests over the rate fail at once with a 429. Requests over the
+    concurrency limit wait in a FIFO queue of at most ``max_queue`` for
+    ``queue_timeout`` seconds, each on a gevent Event so greenlets and
+    threads both yield while they wait: a release hands its slot straight
+    to the oldest waiter. A full queue or a timeout is a 503. Both errors
+    carry a Retry-After header, ``retry_after`` seconds for the 503.
+    """
+
+    def __init__(self, max_concurrent=None, max_queue=0, queue_timeout=1.0,
+                 rate=None, burst=None, retry_after=1):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.retry_after = retry_after
+        self.active = 0
+        self.admitted = 0
+        self.rejected_rate = 0
+        self.rejected_queue = 0
+        self.timed_out = 0
+        self._queue = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait for a slot or raise HTTPTooManyRequests or
+        HTTPServiceUnavailable."""
+        if self.bucket is not None:
+            wait = self.bucket.take()
+            if wait:
+                with self._lock:
+                    self.rejected_rate += 1
+                raise HTTPTooManyRequests(
+                    retry_after=int(math.ceil(wait)))
+        with self._lock:
+            if not self._queue and (self.max_concurrent is None or
+                                    self.active < self.max_concurrent):
+                self.active += 1
+                self.admitted += 1
+                return
+            if len(self._queue) >= self.max_queue:
+                self.rejected_queue += 1
+                raise HTTPServiceUnavailable(retry_after=self.retry_after)
+            ticket = Event()
+            self._queue.append(ticket)
+        ticket.wait(self.queue_timeout)
+        with self._lock:
+            # the slot may have been handed over right after the timeout.
+            if ticket.is_set():
+                return
+            self._queue.remove(ticket)
+            self.timed_out += 1
+        raise HTTPServiceUnavailable(retry_after=self.retry_after)
+
+    def release(self):
+        with self._lock:
+            if self._queue:
+                # the slot goes to the oldest waiter, active is unchanged.
+                self.admitted += 1
+                self._queue.popleft().set()
+            else:
+                self.active -= 1
+
+    def stats(self):
+        with self._lock:
+            return dict(active=self.active, queued=len(self._queue),
+                        admitted=self.admitted,
+                        rejected_rate=self.rejected_rate,
+                        rejected_queue=self.rejected_queue,
+                        timed_out=self.timed_out,
+                        max_concurrent=self.max_concurrent,
+                        max_queue=self.max_queue,
+                        rate=self.bucket.rate if self.bucket else None)
@@ -0,0 +1,184 @@
+# coding=utf-8
+
+import copy
+import threading
+from collections import OrderedDict
+from time import time
+
+from .utils import dumps, loads
+
+
+class LRUCache(object):
+    """Thread safe, size bounded LRU cache.
+
+    Entries expire ``ttl`` seconds after they were set, ``None`` means they
+    only leave the cache when evicted. ``hits`` and ``misses`` count the
+    lookups done through :meth:`get`.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= time():
+                self.misses += 1
+                return default
+            self._data[key] = (expires, value)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        expires = time() + ttl if ttl is not None else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    # mapping style assignment, for users such as SQLAlchemy's
+    # compiled_cache execution option.
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class LocalClient(object):
+    """In-process stand-in for a redis client, for tests and development.
+
+    Implements the ``get``, ``set`` and ``delete`` calls used by
+    :class:`SharedCache`.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value, expires = self._data.get(key, (None, None))
+            if expires is not None and expires <= time():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        expires = time() + ex if ex else None
+        with self._lock:
+            self._data[key] = (value, expires)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return len([self._data.pop(key) for key in keys
+                        if key in self._data])
+
+
+class SharedCache(object):
+    """Cache kept in a key-value store shared by processes, e.g. redis.
+
+    ``client`` needs redis-py's ``get(key)``, ``set(key, value, ex=None)``
+    and ``delete(key)``; values are stored as BSON aware JSON.
+    """
+
+    def __init__(self, client, prefix='seed:', ttl=None):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        return loads(value)
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        self.client.set(self.prefix + key, dumps(value),
+                        ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+class DocumentCache(object):
+    """Read-through cache of documents by collection, _id and projection.
+
+    ``backend`` is a :class:`LRUCache`, a :class:`SharedCache` or any object
+    with their ``get``/``set``/``delete`` methods. All projections of one
+    document share a backend entry, so :meth:`invalidate` drops them
+    together. A document loaded while this process invalidated anything
+    is not cached, it may predate the update; invalidations made by other
+    processes are only seen through a shared backend.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._invalidations = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(collection, doc_id):
+        return '{0}:{1}'.format(collection, doc_id)
+
+    def get(self, collection, doc_id, projection, load):
+        """Return the cached document, or ``load()`` it and cache it."""
+        key = self._key(collection, doc_id)
+        if isinstance(projection, list):
+            projection = sorted(projection)
+        field = dumps(projection, sort_keys=True)
+        entry = self.backend.get(key) or {}
+        if field in entry:
+            self.hits += 1
+            return copy.deepcopy(entry[field])
+        self.misses += 1
+        invalidations = self._invalidations
+        doc = load()
+        if doc is not None and invalidations == self._invalidations:
+            entry = dict(entry)
+            entry[field] = copy.deepcopy(doc)
+            self.backend.set(key, entry)
+        return doc
+
+    def invalidate(self, collection, *doc_ids):
+        with self._lock:
+            self._invalidations += 1
+        for doc_id in doc_ids:
+            self.backend.delete(self._key(collection, doc_id))
+
+    def stats(self):
+        stats = dict(hits=self.hits, misses=self.misses)
+        if hasattr(self.backend, '__len__'):
+            stats['size'] = len(self.backend)
+        return stats
@@ -1,13 +1,55 @@
 # coding=utf-8
 
+from __future__ import print_function
+
 from flask import current_app as app
 
 
+def print_diff(diff):
+    for kind, value in sorted(diff.items()):
+        if isinstance(value, dict):
+            for collection, states in sorted(value.items()):
+                for state in ('missing', 'extra', 'changed'):
+                    for name in states[state]:
+                        print('{0} {1} {2}'.format(collection, state, name))
+        else:
+            for name in value:
+                print('{0} missing {1}'.format(kind, name))
+
+
 def db(operation):
     with app.app_context():
         if operation == 'init':
-            app.db_driver.init_db()
+            print_diff(app.db_driver.init_db())
+        elif operation == 'diff':
+            print_diff(app.db_driver.init_db(dry_run=True))
         elif operation == 'migrate':
             app.db_driver.migrate()
         elif operation == 'drop':
             app.db_driver.drop_db()
+        elif operation == 'indexes':
+            print_diff(dict(indexes=app.db_driver.sync_indexes(apply=False)))
+
+
+def explain():
+    """Explain the typical queries of every handler, flag COLLSCANs."""
+    failed = 0
+    for handler in app.extensions['seed'].handlers:
+        for query_string in handler.explain_queries():
+            url = '{0}?{1}'.format(handler.set_url, query_string)
+            with app.test_request_context(url):
+                query = handler.get_query()
+                stages = handler._model.plan_stages(**query)
+            flag = 'COLLSCAN' in stages
+            failed += flag
+            print('{0} {1} {2}'.format('!!' if flag else 'ok', url,
+                                       ' < '.join(stages)))
+    return 1 if failed else 0
+
+
+def serve(host=None, port=None, workers=None):
+    app.extensions['seed'].run(
+        host=host,
+        port=int(port) if port is not None else None,
+        workers=int(workers) if workers is not None else None
+    )
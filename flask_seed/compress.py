@@ -0,0 +1,192 @@
+# coding=utf-8
+
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .profiling import timed
+
+
+class GzipEncoder(object):
+
+    name = 'gzip'
+    default_level = 6
+
+    def __init__(self, level=None):
+        if level is None:
+            level = self.default_level
+        # wbits 16 + MAX_WBITS writes the gzip header and trailer.
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                            16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliEncoder(object):
+
+    name = 'br'
+    # 11, brotli's own default, is far too slow for responses.
+    default_level = 4
+
+    def __init__(self, level=None):
+        if level is None:
+            level = self.default_level
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class ZstdEncoder(object):
+
+    name = 'zstd'
+    default_level = 3
+
+    def __init__(self, level=None):
+        if level is None:
+            level = self.default_level
+        self._compressor = zstandard.ZstdCompressor(
+            level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+ENCODERS = {'gzip': GzipEncoder}
+if brotli is not None:
+    ENCODERS['br'] = BrotliEncoder
+if zstandard is not None:
+    ENCODERS['zstd'] = ZstdEncoder
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain', 'text/html',
+                          'text/csv')
+
+
+def _to_bytes(chunk):
+    if isinstance(chunk, bytes):
+        return chunk
+    return chunk.encode('utf-8')
+
+
+class Compressor(object):
+    """Compress responses with the best encoding the client accepts.
+
+    ``encodings`` are tried in order of preference among gzip, br (needs
+    the brotli package) and zstd (needs zstandard); those not installed
+    are skipped. ``levels`` maps an encoding to its compression level,
+    each has a fast default. Bodies smaller than ``min_size`` bytes are
+    sent as they are, the CPU costs more than the bytes saved.
+
+    Streamed responses are compressed chunk by chunk as they are sent,
+    each chunk flushed so the client can decode it at once; their first
+    chunks are read up to ``min_size`` bytes to know if they are worth
+    compressing.
+    """
+
+    def __init__(self, encodings=('br', 'zstd', 'gzip'), min_size=1024,
+                 levels=None, mimetypes=COMPRESSIBLE_MIMETYPES):
+        self.encodings = [name for name in encodings if name in ENCODERS]
+        self.min_size = min_size
+        self.levels = levels or {}
+        self.mimetypes = mimetypes
+
+    def negotiate(self, request):
+        """Return the name of the encoding to use, None for identity."""
+        if not self.encodings:
+            return None
+        return request.accept_encodings.best_match(self.encodings)
+
+    def encoder(self, name):
+        return ENCODERS[name](self.levels.get(name))
+
+    def compressible(self, request, response):
+        return request.method != 'HEAD' and \
+            200 <= response.status_code < 300 and \
+            response.status_code != 204 and \
+            'Content-Encoding' not in response.headers and \
+            response.mimetype in self.mimetypes
+
+    def __call__(self, request, response):
+        """Compress ``response`` in place if it is worth it, return it."""
+        if not self.compressible(request, response):
+            return response
+        response.vary.add('Accept-Encoding')
+        name = self.negotiate(request)
+        if name is None:
+            return response
+        if response.is_streamed:
+            return self.compress_stream(response, name)
+        body = response.get_data()
+        if len(body) < self.min_size:
+            return response
+        encoder = self.encoder(name)
+        with timed('compress'):
+            response.set_data(encoder.compress(body) + encoder.finish())
+        self.mark(response, name)
+        return response
+
+    def compress_stream(self, response, name):
+        close = getattr(response.response, 'close', None)
+        chunks = iter(response.response)
+        head, size = [], 0
+        for chunk in chunks:
+            chunk = _to_bytes(chunk)
+            head.append(chunk)
+            size += len(chunk)
+            if size >= self.min_size:
+                break
+        else:
+            # the whole body was read and is small.
+            if close is not None:
+                close()
+            response.set_data(b''.join(head))
+            return response
+
+        encoder = self.encoder(name)
+
+        def generate():
+            yield encoder.compress(b''.join(head)) + encoder.flush()
+            for chunk in chunks:
+                yield encoder.compress(_to_bytes(chunk)) + encoder.flush()
+            yield encoder.finish()
+
+        if close is not None:
+            response.call_on_close(close)
+        response.response = generate()
+        response.headers.pop('Content-Length', None)
+        self.mark(response, name)
+        return response
+
+    def mark(self, response, name):
+        response.headers['Content-Encoding'] = name
+        # the compressed bytes differ from the identity ones.
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
@@ -1,13 +1,22 @@
 # coding=utf-8
 
 from .mongo import MongoDriver, MongoBase
-from .sql import SQLDriver, SQLBase
+
+try:
+    from .sql import SQLDriver, SQLBase
+except ImportError:
+    # pip install Flask-Seed[sql]
+    SQLDriver = SQLBase = None
 
 
 def get_db_driver(name):
     if name == 'mongo':
         return MongoDriver, MongoBase
     elif name == 'sql':
+        if SQLDriver is None:
+            raise RuntimeError('The sql driver needs SQLAlchemy and '
+                               'Flask-SQLAlchemy: pip install '
+                               'Flask-Seed[sql].')
         return SQLDriver, SQLBase
     else:
         raise RuntimeError('{} is not correct db driver name.'.format(name))
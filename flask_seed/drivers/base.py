@@ -0,0 +1,105 @@
+# coding=utf-8
+
+import logging
+import os
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class BlockAllocator(object):
+    """Hand out integer ids from blocks reserved in a shared counter.
+
+    One reservation in ``ids`` (a collection, a table...) takes
+    ``block_size`` ids for this process, which are then handed out
+    locally. If ``low_water`` is set (None means a quarter of the
+    block), the next block is reserved on a
+    background thread as soon as fewer than ``low_water`` ids are left,
+    so requests only wait for a reservation when the ids run out before
+    it is done. Ids are unique across processes; ids left in a block
+    when the process exits are lost, so the sequence may have gaps.
+    Subclasses implement :meth:`_reserve`.
+
+    The lock is only held while ids are handed out from memory and, when
+    none are left, during the reservation the caller waits for anyway.
+    """
+
+    def __init__(self, ids, name, block_size=1, low_water=0):
+        self.ids = ids
+        self.name = name
+        self.block_size = max(int(block_size), 1)
+        if low_water is None:
+            low_water = self.block_size // 4
+        self.low_water = int(low_water)
+        self._lock = threading.Lock()
+        self._blocks = deque()
+        self._pid = os.getpid()
+        self._refilling = False
+
+    @property
+    def available(self):
+        return sum(end - start for start, end in self._blocks)
+
+    def _reserve(self, size):
+        """Reserve ``size`` ids, return them as ``[start, end)``."""
+        raise NotImplementedError
+
+    def take(self, count=1):
+        with self._lock:
+            if self._pid != os.getpid():
+                # blocks reserved before fork() belong to the parent, and
+                # so does its refill thread.
+                self._blocks.clear()
+                self._pid = os.getpid()
+                self._refilling = False
+            available = self.available
+            if available < count:
+                self._blocks.append(
+                    self._reserve(max(self.block_size, count - available)))
+            ids = []
+            while len(ids) < count:
+                block = self._blocks[0]
+                size = min(count - len(ids), block[1] - block[0])
+                ids.extend(range(block[0], block[0] + size))
+                block[0] += size
+                if block[0] == block[1]:
+                    self._blocks.popleft()
+            if self.low_water and not self._refilling and \
+                    self.available < self.low_water:
+                self._refilling = True
+                thread = threading.Thread(target=self._refill,
+                                          name='seed-id-refill')
+                thread.daemon = True
+                thread.start()
+            return ids
+
+    def _refill(self):
+        block = None
+        try:
+            block = self._reserve(self.block_size)
+        except Exception:
+            # take() reserves in the request once the ids run out.
+            logger.exception('Cannot reserve %s ids.', self.name)
+        with self._lock:
+            if block is not None and self._pid == os.getpid():
+                self._blocks.append(block)
+            self._refilling = False
+
+
+def bulk_results(doc_ids, errors, found=None):
+    """Build one result dict per id of a bulk operation.
+
+    ``errors`` maps item index to the server's error message, ``found``
+    is the set of ids that existed before the operation, if known.
+    """
+    results = []
+    for index, doc_id in enumerate(doc_ids):
+        if index in errors:
+            results.append(dict(_id=doc_id, ok=False,
+                                error=errors[index]))
+        elif found is not None and doc_id not in found:
+            results.append(dict(_id=doc_id, ok=False, error='not found'))
+        else:
+            results.append(dict(_id=doc_id, ok=True))
+    return results
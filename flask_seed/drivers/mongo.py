@@ -1,25 +1,240 @@
 # coding=utf-8
 
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict, deque
 from time import strftime
 
 import pymongo
 import pymongo.errors
-from pymongo import ReturnDocument, uri_parser
+from bson.timestamp import Timestamp
+from pymongo import IndexModel, ReturnDocument, UpdateOne, WriteConcern, \
+    monitoring, uri_parser
 from pymongo.read_preferences import ReadPreference
 from flask_pymongo import PyMongo, BSONObjectIdConverter
 from flask_pymongo.wrappers import MongoClient, MongoReplicaSetClient
-from flask import current_app
+from flask import current_app, g, has_request_context, request
 
 import six
 
+from ..cache import LRUCache, DocumentCache
+from ..profiling import CommandStats
+from ..utils import dumps
+from .base import BlockAllocator, bulk_results
+
+try:
+    from pymongo.read_concern import ReadConcern
+except ImportError:
+    ReadConcern = None
+
+logger = logging.getLogger(__name__)
+
 DAY_FORMAT = '%Y%m%d'
 
+# index options compared by MongoDriver.sync_indexes.
+INDEX_OPTIONS = ('unique', 'sparse', 'expireAfterSeconds',
+                 'partialFilterExpression')
+
+# ids document holding the fingerprint of the last schema init_db applied.
+SCHEMA_KEY = 'seed:schema'
+
+# config suffix and MongoClient keyword of the pool options.
+POOL_OPTIONS = (
+    ('MIN_POOL_SIZE', 'minPoolSize'),
+    ('MAX_POOL_SIZE', 'maxPoolSize'),
+    ('MAX_IDLE_TIME_MS', 'maxIdleTimeMS'),
+    ('WAIT_QUEUE_TIMEOUT_MS', 'waitQueueTimeoutMS'),
+    ('WAIT_QUEUE_MULTIPLE', 'waitQueueMultiple'),
+    ('SERVER_SELECTION_TIMEOUT_MS', 'serverSelectionTimeoutMS'),
+)
+
+
+def get_read_preference(value):
+    """Return the read preference named ``value``, e.g.
+    'SECONDARY_PREFERRED', or ``value`` if it already is one."""
+    if isinstance(value, six.string_types):
+        read_preference = getattr(ReadPreference, value.upper(), None)
+        if read_preference is None:
+            raise ValueError('No such read preference name (%r)' % value)
+        return read_preference
+    return value
+
+
+class PoolStats(getattr(monitoring, 'ConnectionPoolListener', object)):
+    """Connection pool counters of one MongoClient (pymongo >= 3.9).
+
+    ``checked_out`` and ``waiting`` are current values, the others are
+    totals since the client was created.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self.check_out_failed = 0
+
+    def _add(self, **deltas):
+        with self._lock:
+            for name, delta in six.iteritems(deltas):
+                setattr(self, name, getattr(self, name) + delta)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._add(created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(closed=1)
+
+    def connection_check_out_started(self, event):
+        self._add(waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._add(waiting=-1, check_out_failed=1)
+
+    def connection_checked_out(self, event):
+        self._add(waiting=-1, checked_out=1)
+
+    def connection_checked_in(self, event):
+        self._add(checked_out=-1)
+
+    def to_dict(self):
+        with self._lock:
+            return dict(created=self.created, closed=self.closed,
+                        open=self.created - self.closed,
+                        checked_out=self.checked_out, waiting=self.waiting,
+                        check_out_failed=self.check_out_failed)
+
+
+class IDAllocator(BlockAllocator):
+    """Hand out integer ids from blocks reserved in the ``ids`` collection.
+
+    One ``$inc`` reserves a block, see :class:`~.base.BlockAllocator`.
+    With ``upsert`` the counter document is created on first use.
+    """
+
+    def __init__(self, ids, name, block_size=1, low_water=0, upsert=False):
+        super(IDAllocator, self).__init__(ids, name, block_size, low_water)
+        self.upsert = upsert
+
+    def _reserve(self, size):
+        try:
+            res = self.ids.find_one_and_update(
+                dict(name=self.name),
+                {'$inc': {'id': size}},
+                return_document=ReturnDocument.AFTER,
+                upsert=self.upsert
+            )
+        except pymongo.errors.DuplicateKeyError:
+            # another process upserted the counter first, $inc it instead.
+            res = self.ids.find_one_and_update(
+                dict(name=self.name),
+                {'$inc': {'id': size}},
+                return_document=ReturnDocument.AFTER
+            )
+        end = res['id'] + 1
+        return [end - size, end]
+
+
+class IndexBuild(object):
+    """Index sync of several collections on worker threads.
+
+    ``report`` fills in as collections finish, see
+    :meth:`MongoDriver.sync_indexes`; ``errors`` maps a collection to the
+    exception its sync raised. ``on_done`` is called with the build once
+    every collection is done.
+    """
+
+    def __init__(self, db, wanted, apply=True, workers=4, progress=None,
+                 on_done=None):
+        self.db = db
+        self.apply = apply
+        self.workers = max(int(workers), 1)
+        self.progress = progress
+        self.on_done = on_done
+        self.total = len(wanted)
+        self.report = {}
+        self.errors = {}
+        self._pending = deque(six.iteritems(wanted))
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def start(self):
+        if not self.total:
+            self._finish()
+        for _ in range(min(self.workers, self.total)):
+            thread = threading.Thread(target=self._work,
+                                      name='seed-index-build')
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def _work(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    return
+                collection, models = self._pending.popleft()
+            diff = None
+            try:
+                diff = MongoDriver.sync_collection_indexes(
+                    self.db[collection], models, self.apply)
+            except Exception as e:
+                self.errors[collection] = e
+            with self._lock:
+                if diff is not None:
+                    self.report[collection] = diff
+                done = len(self.report) + len(self.errors)
+            if self.progress is not None:
+                try:
+                    self.progress(collection, diff, done, self.total)
+                except Exception:
+                    # a broken callback must not stop the build.
+                    logger.exception('Index progress of %s failed.',
+                                     collection)
+            if done == self.total:
+                self._finish()
+
+    def _finish(self):
+        try:
+            if self.on_done is not None:
+                self.on_done(self)
+        finally:
+            self._done.set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def join(self, timeout=None):
+        """Wait for the build, at most ``timeout`` seconds."""
+        self._done.wait(timeout)
+        return self
+
 
 class MongoDriver(PyMongo):
 
     def __init__(self, app=None, config_prefix='MONGO'):
+        self._client = None
+        self._client_pid = None
+        self._client_lock = threading.Lock()
         super(MongoDriver, self).__init__(app, config_prefix)
         self.col_classes = []
+        self.id_allocators = {}
 
     def init_app(self, app, config_prefix='MONGO'):
         """Initialize the `app` for use with this :class:`~PyMongo`. This is
@@ -32,6 +247,25 @@ class MongoDriver(PyMongo):
         "PREFIX" defaults to "MONGO". If ``PREFIX_URL`` is set, it is
         assumed to have all appropriate configurations, and the other
         keys are overwritten using their values as present in the URI.
+        The connection pool is tuned with ``PREFIX_MIN_POOL_SIZE``,
+        ``PREFIX_MAX_POOL_SIZE``, ``PREFIX_MAX_IDLE_TIME_MS``,
+        ``PREFIX_WAIT_QUEUE_TIMEOUT_MS``, ``PREFIX_WAIT_QUEUE_MULTIPLE`` and
+        ``PREFIX_SERVER_SELECTION_TIMEOUT_MS``. The client itself is only
+        created on first use in each process, see :meth:`client`.
+        ``PREFIX_ID_BLOCK_SIZE`` (100) and ``PREFIX_ID_LOW_WATER`` (None, a
+        quarter of the block) configure the :class:`IDAllocator` used by
+        :meth:`get_id`,
+        ``PREFIX_SERIAL_BLOCK_SIZE`` the one of :meth:`get_serial_numbers`.
+        ``PREFIX_CACHE_SIZE`` and ``PREFIX_CACHE_TTL`` enable an in-process
+        document cache for :meth:`MongoBase.get`, ``PREFIX_CACHE_BACKEND``
+        replaces it with a shared one such as
+        :class:`~flask_seed.cache.SharedCache`.
+        Commands slower than ``PREFIX_SLOW_QUERY_MS`` milliseconds are
+        logged, see :class:`~flask_seed.profiling.CommandStats`.
+        Requests that asked for read-your-writes share a causally
+        consistent session, see :meth:`request_session`.
+        :meth:`init_db` builds indexes ``PREFIX_INDEX_WORKERS`` collections
+        at a time.
         :param flask.Flask app: the application to configure for use with
            this :class:`~PyMongo`
         :param str config_prefix: determines the set of configuration
@@ -99,7 +333,6 @@ class MongoDriver(PyMongo):
             app.config.setdefault(key('USERNAME'), None)
             app.config.setdefault(key('PASSWORD'), None)
             app.config.setdefault(key('REPLICA_SET'), None)
-            app.config.setdefault(key('MAX_POOL_SIZE'), None)
 
             try:
                 int(app.config[key('PORT')])
@@ -131,7 +364,6 @@ class MongoDriver(PyMongo):
 
         replica_set = app.config[key('REPLICA_SET')]
         dbname = app.config[key('DBNAME')]
-        max_pool_size = app.config[key('MAX_POOL_SIZE')]
         socket_timeout_ms = app.config[key('SOCKET_TIMEOUT_MS')]
         connect_timeout_ms = app.config[key('CONNECT_TIMEOUT_MS')]
 
@@ -144,6 +376,26 @@ class MongoDriver(PyMongo):
         # document class is not supported by URI, using setdefault in all cases
         document_class = app.config.setdefault(key('DOCUMENT_CLASS'), None)
 
+        self.id_block_size = app.config.setdefault(key('ID_BLOCK_SIZE'), 100)
+        self.id_low_water = app.config.setdefault(key('ID_LOW_WATER'), None)
+        self.serial_block_size = app.config.setdefault(
+            key('SERIAL_BLOCK_SIZE'), 1)
+        self._serial_allocator = (None, None)
+
+        cache_backend = app.config.setdefault(key('CACHE_BACKEND'), None)
+        cache_size = app.config.setdefault(key('CACHE_SIZE'), 0)
+        cache_ttl = app.config.setdefault(key('CACHE_TTL'), 60)
+        if cache_backend is None and cache_size:
+            cache_backend = LRUCache(cache_size, cache_ttl)
+        self.doc_cache = None
+        if cache_backend is not None:
+            self.doc_cache = DocumentCache(cache_backend)
+
+        self.command_stats = CommandStats(
+            app.config.setdefault(key('SLOW_QUERY_MS'), None), app.logger)
+        self.index_workers = app.config.setdefault(key('INDEX_WORKERS'), 4)
+        self.logger = app.logger
+
         args = [host]
 
         kwargs = {
@@ -174,92 +426,319 @@ class MongoDriver(PyMongo):
             kwargs['replicaSet'] = replica_set
             connection_cls = MongoClient
 
-        if max_pool_size is not None:
-            kwargs['max_pool_size'] = max_pool_size
+        for suffix, option in POOL_OPTIONS:
+            value = app.config.setdefault(key(suffix), None)
+            if value is None:
+                continue
+            if pymongo.version_tuple[0] < 3:
+                if suffix == 'MAX_POOL_SIZE':
+                    kwargs['max_pool_size'] = value
+            else:
+                kwargs[option] = value
 
         if document_class is not None:
             kwargs['document_class'] = document_class
 
-        cx = connection_cls(*args, **kwargs)
-        db = cx[dbname]
+        def connect():
+            client_kwargs = dict(kwargs)
+            pool_stats = PoolStats()
+            listeners = []
+            if hasattr(monitoring, 'ConnectionPoolListener'):
+                listeners.append(pool_stats)
+            if self.command_stats.enabled:
+                listeners.append(self.command_stats)
+            if listeners:
+                client_kwargs['event_listeners'] = listeners
+            cx = connection_cls(*args, **client_kwargs)
+            db = cx[dbname]
 
-        if any(auth):
-            mechanism = app.config[key('AUTH_MECHANISM')]
-            db.authenticate(username, password, mechanism=mechanism)
+            if any(auth):
+                mechanism = app.config[key('AUTH_MECHANISM')]
+                db.authenticate(username, password, mechanism=mechanism)
+            return cx, db, pool_stats
 
-        app.extensions['pymongo'][config_prefix] = (cx, db)
+        self.connect = connect
+        app.after_request(self.send_operation_time)
+        app.teardown_request(self.end_request_session)
+        app.extensions['pymongo'][config_prefix] = self
         app.url_map.converters['ObjectId'] = BSONObjectIdConverter
 
-    def init_db(self):
-        self.init_indexes()
-        self.init_ids()
+    def client(self):
+        """Return this process's ``(client, db, pool_stats)``.
+
+        The client is created on first use, and again in a child process
+        after fork(), so no process ever uses sockets it inherited.
+        """
+        pid = os.getpid()
+        if self._client_pid != pid:
+            with self._client_lock:
+                if self._client_pid != pid:
+                    self._client = self.connect()
+                    self._client_pid = pid
+        return self._client
+
+    @property
+    def cx(self):
+        return self.client()[0]
+
+    @property
+    def db(self):
+        return self.client()[1]
+
+    def pool_stats(self):
+        """Return the connection pool counters of this process."""
+        return self.client()[2].to_dict()
+
+    def request_session(self):
+        """Return the causally consistent session of the request.
+
+        It only exists in requests flagged by a handler with
+        ``read_your_writes``: every operation of the request then reads
+        what the previous ones wrote, even from a secondary. The
+        session's operation time goes back in an ``Operation-Time`` header
+        which, sent with the next request, carries the guarantee over.
+        """
+        if not has_request_context() or \
+                not g.get('seed_read_your_writes'):
+            return None
+        session = g.get('seed_session')
+        if session is None:
+            session = self.cx.start_session(causal_consistency=True)
+            operation_time = request.headers.get('Operation-Time')
+            if operation_time:
+                try:
+                    session.advance_operation_time(Timestamp(
+                        *[int(part) for part in operation_time.split('.')]))
+                except (TypeError, ValueError):
+                    pass
+            g.seed_session = session
+        return session
+
+    def send_operation_time(self, response):
+        session = g.get('seed_session')
+        operation_time = session and session.operation_time
+        if operation_time is not None:
+            response.headers['Operation-Time'] = '{0}.{1}'.format(
+                operation_time.time, operation_time.inc)
+        return response
+
+    def end_request_session(self, exc=None):
+        session = g.pop('seed_session', None)
+        if session is not None:
+            session.end_session()
+
+    def schema_fingerprint(self):
+        """Hash the declared counters and indexes of every model."""
+        schema = sorted((cls.__collection__,
+                         [model.document for model in cls.index_models()])
+                        for cls in self.col_classes)
+        return hashlib.md5(
+            dumps(schema, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def init_db(self, dry_run=False, force=False, background=False,
+                progress=None):
+        """Create the missing counters and indexes.
+
+        Returns ``{'ids': [counter names], 'indexes': report}``, what was
+        missing, see :meth:`sync_indexes` for the report. Nothing is done
+        when the schema fingerprint stored by the last complete run still
+        matches, unless ``force``. ``dry_run`` only computes the diff.
+        With ``background`` the indexes keep building after the call
+        returns, ``indexes`` is then the running :class:`IndexBuild`.
+        """
+        fingerprint = self.schema_fingerprint()
+        if not (dry_run or force):
+            stored = self.db.ids.find_one(dict(name=SCHEMA_KEY),
+                                          projection=['hash'])
+            if stored and stored.get('hash') == fingerprint:
+                return dict(ids=[], indexes={})
+
+        def store_fingerprint(build):
+            if not build.errors:
+                self.db.ids.update_one(dict(name=SCHEMA_KEY),
+                                       {'$set': {'hash': fingerprint}},
+                                       upsert=True)
+
+        ids = self.init_ids(apply=not dry_run)
+        build = self.build_indexes(
+            apply=not dry_run, progress=progress,
+            on_done=None if dry_run else store_fingerprint)
+        if background:
+            return dict(ids=ids, indexes=build)
+        return dict(ids=ids, indexes=build.join().report)
 
     def init_indexes(self):
-        try:
-            for cls in self.col_classes:
-                col = self.db[cls.__collection__]
-                index = cls.indexes
-                if not index:
-                    continue
-                if 'expireAfterSeconds' in index:
-                    col.create_index(index['name'], expireAfterSeconds=index[
-                        'expireAfterSeconds'])
-                if 'unique' in index:
-                    col.create_index(index['name'], unique=index['unique'])
-        except pymongo.errors.CollectionInvalid:
-            pass
-
-    def init_ids(self):
+        return self.sync_indexes()
+
+    @staticmethod
+    def _same_index(document, info):
+        keys = [(key, int(direction)) if isinstance(direction, float)
+                else (key, direction) for key, direction in info['key']]
+        if keys != list(document['key'].items()):
+            return False
+        return all(document.get(option) == info.get(option)
+                   for option in INDEX_OPTIONS)
+
+    @classmethod
+    def sync_collection_indexes(cls, col, models, apply=True):
+        existing = col.index_information()
+        missing, changed = [], []
+        for model in models:
+            info = existing.get(model.document['name'])
+            if info is None:
+                missing.append(model)
+            elif not cls._same_index(model.document, info):
+                changed.append(model.document['name'])
+        names = set(model.document['name'] for model in models)
+        extra = [name for name in existing
+                 if name != '_id_' and name not in names]
+        if missing and apply:
+            col.create_indexes(missing)
+        return dict(missing=[model.document['name'] for model in missing],
+                    extra=sorted(extra), changed=changed)
+
+    def build_indexes(self, apply=True, workers=None, progress=None,
+                      on_done=None):
+        """Start syncing the indexes of every collection concurrently.
+
+        ``workers`` defaults to ``PREFIX_INDEX_WORKERS``. ``progress`` is
+        called with ``(collection, diff, done, total)`` as collections
+        finish, by default it logs them. Returns the started
+        :class:`IndexBuild`.
+        """
+        wanted = OrderedDict()
         for cls in self.col_classes:
-            res = self.db.ids.find_one(dict(name=cls.__collection__))
-            if not res:
-                self.db.ids.insert_one(
-                    dict(name=cls.__collection__, id=0))
-        res = self.db.ids.find_one(dict(name='todo_serial_number'))
-        if not res:
-            today = strftime(DAY_FORMAT)
-            self.db.ids.insert_one(
-                dict(name='todo_serial_number', id=0, today=today)
-            )
+            wanted.setdefault(cls.__collection__, []).extend(
+                cls.index_models())
+        if progress is None:
+            progress = self.log_index_progress
+        return IndexBuild(self.db, wanted, apply,
+                          workers or self.index_workers, progress,
+                          on_done).start()
+
+    def log_index_progress(self, collection, diff, done, total):
+        if diff is None:
+            self.logger.error('Indexes of %s failed (%d/%d).',
+                              collection, done, total)
+        elif diff['missing']:
+            self.logger.info('Indexes of %s: created %s (%d/%d).',
+                             collection, ', '.join(diff['missing']),
+                             done, total)
+
+    def sync_indexes(self, apply=True):
+        """Compare the declared indexes with the database ones.
+
+        Missing indexes are created unless ``apply`` is False. Returns, per
+        collection, the ``missing`` index names, the ``extra`` ones that
+        exist but are not declared, and the ``changed`` ones whose keys or
+        options differ; extra and changed indexes are only reported.
+        """
+        return self.build_indexes(apply, progress=lambda *args: None) \
+            .join().report
+
+    def init_ids(self, apply=True):
+        """Create the missing counters with one bulk upsert.
+
+        Returns the names of the counters that were missing.
+        """
+        names = sorted(set(cls.__collection__ for cls in self.col_classes))
+        existing = set(doc['name'] for doc in self.db.ids.find(
+            {'name': {'$in': names}}, projection=['name']))
+        missing = [name for name in names if name not in existing]
+        if not apply:
+            return missing
+        # counters are upserted by name, which must stay unique.
+        self.db.ids.create_index('name', unique=True)
+        if missing:
+            try:
+                self.db.ids.bulk_write(
+                    [UpdateOne(dict(name=name), {'$setOnInsert': {'id': 0}},
+                               upsert=True) for name in missing],
+                    ordered=False)
+            except pymongo.errors.BulkWriteError as exc:
+                # another process upserted some counters first.
+                if any(error['code'] != 11000
+                       for error in exc.details['writeErrors']):
+                    raise
+        return missing
 
     def drop_db(self):
         self.cx.drop_database(self.db)
 
+    def after_fork(self):
+        """Drop the client inherited through fork().
+
+        The parent's sockets must not be closed from here, the next use
+        creates a new client, see :meth:`client`.
+        """
+        with self._client_lock:
+            self._client = None
+            self._client_pid = None
+        self.id_allocators = {}
+
     def register(self, models):
         for model in models:
             self.col_classes.append(model)
-            setattr(self, model.__name__, model())
+            setattr(self, model.__name__, model(self))
+
+    def get_allocator(self, collection):
+        # keyed by pid too: the parent's allocator uses the parent's client.
+        key = (collection, os.getpid())
+        allocator = self.id_allocators.get(key)
+        if allocator is None:
+            block_size = self.id_block_size
+            for cls in self.col_classes:
+                if cls.__collection__ == collection and cls.id_block_size:
+                    block_size = cls.id_block_size
+            allocator = self.id_allocators.setdefault(
+                key,
+                IDAllocator(self.db.ids, collection, block_size,
+                            self.id_low_water)
+            )
+        return allocator
+
+    def get_ids(self, collection, count):
+        return self.get_allocator(collection).take(count)
 
     def get_id(self, collection):
-        res = self.db.ids.find_one_and_update(
-            dict(name=collection),
-            {'$inc': {'id': 1}},
-            return_document=ReturnDocument.AFTER
-        )
-        return res['id']
+        return self.get_ids(collection, 1)[0]
 
-    def get_serial_number(self):
-        filter = dict(name='todo_serial_number')
-        todo_serial_number = self.db.ids.find_one(filter)
+    def get_serial_numbers(self, count=1):
+        """Return ``count`` serial numbers of today, e.g. ``201610180001``.
+
+        Each day counts in its own ``todo_serial_number:<day>`` document,
+        created by the first ``$inc``, so the rollover and the increment are
+        one atomic operation. Serials are reserved
+        ``MONGO_SERIAL_BLOCK_SIZE`` at a time, see :class:`IDAllocator`.
+        The day the per-day documents are deployed, they start after the
+        serials the single legacy ``todo_serial_number`` document gave out.
+        """
         today = strftime(DAY_FORMAT)
-        if today == todo_serial_number['today']:
-            res = self.db.ids.find_one_and_update(
-                filter,
-                {'$inc': {'id': 1}},
-                return_document=ReturnDocument.AFTER
-            )
-            id = int(res['id'])
-            if id > 9999:
-                return '{today}{id}'.format(today=today, id=id)
-            else:
-                return '{today}{id:0>4}'.format(today=today, id=id)
+        name = 'todo_serial_number:{}'.format(today)
+        key, allocator = self._serial_allocator
+        if key != (name, os.getpid()):
+            self.seed_serial_numbers(name, today)
+            allocator = IDAllocator(self.db.ids, name,
+                                    self.serial_block_size, upsert=True)
+            self._serial_allocator = ((name, os.getpid()), allocator)
+        return ['{today}{id:0>4}'.format(today=today, id=id)
+                for id in allocator.take(count)]
 
-        else:
-            self.db.ids.find_one_and_update(
-                filter,
-                {'$set': {'id': 1, 'today': today}}
-            )
-            return today + '0001'
+    def get_serial_number(self):
+        return self.get_serial_numbers(1)[0]
+
+    def seed_serial_numbers(self, name, today):
+        """Start the ``name`` counter of ``today`` after the legacy one."""
+        legacy = self.db.ids.find_one(dict(name='todo_serial_number'))
+        if not legacy or legacy.get('today') != today or \
+                not legacy.get('id'):
+            return
+        update = {'$max': {'id': int(legacy['id'])}}
+        try:
+            self.db.ids.update_one(dict(name=name), update, upsert=True)
+        except pymongo.errors.DuplicateKeyError:
+            # another process upserted the counter first.
+            self.db.ids.update_one(dict(name=name), update)
 
 
 class MongoBase(object):
@@ -278,18 +757,179 @@ class MongoBase(object):
             dbref = {
                 'user_id': 'User'
             }
+
+    dbref maps fields holding ids of other documents to their model, for
+    handlers to expand, see flask_seed.expand.Expander.
+
+    id_block_size overrides MONGO_ID_BLOCK_SIZE for this collection.
+    cacheable = False keeps get() away from the driver's document cache.
+    Writes made through the raw collection methods do not invalidate it.
+
+    version_field names a counter update() increments on every document,
+    track_changes keeps a collection change counter in the ids collection.
+    Handlers build their ETags from these.
+
+    read_preference (a ReadPreference or its name, e.g.
+    'SECONDARY_PREFERRED'), read_concern (a level, e.g. 'majority') and
+    write_concern (WriteConcern arguments, e.g. {'w': 0}) override the
+    client's for this collection; None keeps them. With an unacknowledged
+    write concern update() and delete() cannot tell if the document
+    existed and report that it did. with_options() returns a copy using
+    other ones, which handlers use for their reads.
+
+    indexes is a list of index definitions: keys as create_index takes
+    them and any create_index option, e.g.
+        indexes = [
+            {'keys': [('user_id', 1), ('created', -1)]},
+            {'keys': 'number', 'unique': True,
+             'partialFilterExpression': {'number': {'$exists': True}}},
+        ]
+    A single dict with the key in 'name' is the older form of one index.
     """
 
     __collection__ = ''
     indexes = {}
     required_fields = []
     dbref = {}
+    id_block_size = None
+    cacheable = True
+    version_field = None
+    track_changes = False
+    read_preference = None
+    read_concern = None
+    write_concern = None
 
-    def __init__(self):
-        self.collection = current_app.db_driver.db[self.__collection__]
+    def __init__(self, driver=None):
+        self.driver = driver if driver is not None \
+            else current_app.db_driver
+        self._db = None
+        self._collection = None
+        self.cache = None
+        if self.cacheable:
+            self.cache = getattr(self.driver, 'doc_cache', None)
+
+    @property
+    def collection(self):
+        db = self.driver.db
+        if db is not self._db:
+            collection = db[self.__collection__]
+            options = self.collection_options()
+            if options:
+                collection = collection.with_options(**options)
+            self._collection = collection
+            self._db = db
+        return self._collection
+
+    def collection_options(self):
+        options = {}
+        if self.read_preference is not None:
+            options['read_preference'] = get_read_preference(
+                self.read_preference)
+        if self.read_concern is not None:
+            options['read_concern'] = ReadConcern(self.read_concern)
+        if self.write_concern is not None:
+            write_concern = self.write_concern
+            if isinstance(write_concern, dict):
+                write_concern = WriteConcern(**write_concern)
+            options['write_concern'] = write_concern
+        return options
+
+    def with_options(self, read_preference=None, read_concern=None,
+                     write_concern=None):
+        """Return a copy of this model whose collection uses the given
+        options; None keeps the model's own."""
+        model = object.__new__(type(self))
+        model.__dict__.update(self.__dict__)
+        for name, value in (('read_preference', read_preference),
+                            ('read_concern', read_concern),
+                            ('write_concern', write_concern)):
+            if value is not None:
+                setattr(model, name, value)
+        model._db = model._collection = None
+        return model
+
+    def session(self):
+        """Return the keyword arguments that run an operation in the
+        request's causally consistent session, if it has one."""
+        session = self.driver.request_session()
+        return {} if session is None else {'session': session}
+
+    @classmethod
+    def index_models(cls):
+        indexes = cls.indexes
+        if isinstance(indexes, dict):
+            indexes = [indexes] if indexes else []
+        models = []
+        for index in indexes:
+            options = dict(index)
+            if 'keys' in options:
+                keys = options.pop('keys')
+            else:
+                keys = options.pop('name')
+            models.append(IndexModel(keys, **options))
+        return models
+
+    def plan_stages(self, filter=None, sort=None, projection=None, **kwargs):
+        """Return the stage names of the winning plan of a query."""
+        plan = self.query(filter=filter, sort=sort, projection=projection,
+                          **kwargs).explain()
+        stages = []
+        pending = [plan['queryPlanner']['winningPlan']]
+        while pending:
+            stage = pending.pop()
+            stages.append(stage['stage'])
+            pending.extend(stage.get('inputStages', []))
+            if 'inputStage' in stage:
+                pending.append(stage['inputStage'])
+        return stages
+
+    def invalidate(self, *doc_ids):
+        if self.cache is not None:
+            self.cache.invalidate(self.__collection__, *doc_ids)
+
+    def changed(self):
+        if self.track_changes:
+            self.driver.db.ids.update_one(
+                dict(name=self.__collection__), {'$inc': {'changes': 1}})
+
+    def changes(self):
+        """Return the collection change counter, see track_changes.
+
+        It is read with the model's options and session, like the
+        documents it stands for. None means it cannot be: a secondary
+        read outside a causal session may be older than the documents
+        read next, and an ETag made from it would outlive them.
+        """
+        session = self.session()
+        if not session and self.read_preference is not None and \
+                get_read_preference(self.read_preference).mode != 0:
+            return None
+        ids = self.driver.db.ids
+        options = self.collection_options()
+        options.pop('write_concern', None)
+        if options:
+            ids = ids.with_options(**options)
+        res = ids.find_one(dict(name=self.__collection__),
+                           projection=['changes'], **session)
+        return res.get('changes', 0) if res else 0
+
+    def get_version(self, doc_id):
+        """Return the version of a document, None if it does not exist.
+
+        It is always read from Mongo, never from the document cache: an
+        in-process cache is only invalidated in the worker that made the
+        update, so other workers would answer 304 for stale versions.
+        """
+        doc = self.collection.find_one({'_id': int(doc_id)},
+                                       projection=[self.version_field],
+                                       **self.session())
+        if doc is None:
+            return None
+        return doc.get(self.version_field, 0)
 
     def query(self, filter=None, sort=None, projection=None,
               skip=0, limit=0, **kwargs):
+        kwargs.update(self.session())
         cursor = self.collection.find(
             filter=filter, projection=projection,
             skip=skip, limit=limit, **kwargs)
@@ -297,48 +937,193 @@ class MongoBase(object):
             cursor.sort(sort)
         return cursor
 
+    def count(self, filter=None, **kwargs):
+        kwargs.update(self.session())
+        if hasattr(self.collection, 'count_documents'):
+            return self.collection.count_documents(filter or {}, **kwargs)
+        return self.collection.count(filter, **kwargs)
+
+    def estimated_count(self):
+        """Count the collection from its metadata, without a query."""
+        if hasattr(self.collection, 'estimated_document_count'):
+            return self.collection.estimated_document_count()
+        return self.collection.count()
+
+    def bucket_totals(self, field, boundaries, filter=None,
+                      value_field=None, op='sum'):
+        """Count the documents per range of ``field`` in one aggregation.
+
+        ``boundaries`` are ascending, bucket ``i`` holds the documents with
+        ``boundaries[i] <= field < boundaries[i + 1]``. With ``value_field``
+        the buckets also get the ``op`` ('sum' or 'avg') of that field.
+        Returns ``{begin: {'count': n, op: value}}``, without empty buckets.
+        """
+        match = {field: {'$gte': boundaries[0], '$lt': boundaries[-1]}}
+        if filter:
+            match = {'$and': [filter, match]}
+        output = {'count': {'$sum': 1}}
+        if value_field:
+            output[op] = {'$' + op: '$' + value_field}
+        pipeline = [
+            {'$match': match},
+            {'$bucket': {'groupBy': '$' + field,
+                         'boundaries': list(boundaries),
+                         'output': output}},
+        ]
+        return dict((doc.pop('_id'), doc)
+                    for doc in self.collection.aggregate(pipeline,
+                                                         **self.session()))
+
     def get(self, doc_id, projection=None):
         try:
             doc_id = int(doc_id)
         finally:
+            if self.cache is not None:
+                return self.cache.get(
+                    self.__collection__, doc_id, projection,
+                    lambda: self.collection.find_one(
+                        {'_id': doc_id}, projection=projection,
+                        **self.session())
+                )
             doc = self.collection.find_one(
-                {'_id': doc_id}, projection=projection
+                {'_id': doc_id}, projection=projection, **self.session()
             )
             return doc
 
+    def get_many(self, doc_ids, projection=None):
+        """Return ``{_id: document}`` of ``doc_ids`` read with one query.
+
+        Missing documents are left out.
+        """
+        cursor = self.collection.find({'_id': {'$in': list(doc_ids)}},
+                                      projection=projection,
+                                      **self.session())
+        return dict((doc['_id'], doc) for doc in cursor)
+
     def create(self, new_doc):
-        new_doc['_id'] = current_app.db_driver.get_id(self.__collection__)
-        self.collection.insert_one(new_doc)
+        new_doc['_id'] = self.driver.get_id(self.__collection__)
+        self.collection.insert_one(new_doc, **self.session())
+        self.changed()
         return new_doc
 
-    def update(self, doc_id, new_doc, unset=None, projection=None):
+    def update(self, doc_id, new_doc, unset=None, projection=None,
+               return_document=True):
+        """Update a document, return it as ``projection`` shapes it.
+
+        Without ``return_document`` no document is sent back by the server
+        and the result is just ``{'_id': doc_id}``. None means the document
+        does not exist.
+        """
         try:
             doc_id = int(doc_id)
         finally:
+            document = {'$set': new_doc}
             if unset is not None:
+                document['$unset'] = unset
+            if self.version_field:
+                new_doc.pop(self.version_field, None)
+                document['$inc'] = {self.version_field: 1}
+            if return_document:
                 res = self.collection.find_one_and_update(
-                    {'_id': doc_id}, {'$set': new_doc, '$unset': unset},
+                    {'_id': doc_id}, document,
                     return_document=ReturnDocument.AFTER,
-                    projection=projection
+                    projection=projection, **self.session()
                 )
             else:
-                res = self.collection.find_one_and_update(
-                    {'_id': doc_id}, {'$set': new_doc},
-                    return_document=ReturnDocument.AFTER,
-                    projection=projection
-                )
+                res = self.collection.update_one({'_id': doc_id}, document,
+                                                 **self.session())
+                found = not res.acknowledged or res.matched_count
+                res = {'_id': doc_id} if found else None
+            self.invalidate(doc_id)
+            self.changed()
             return res
 
     def delete(self, doc_id):
         try:
             doc_id = int(doc_id)
         finally:
-            res = self.collection.delete_one({'_id': doc_id})
-            if res.deleted_count == 1:
+            res = self.collection.delete_one({'_id': doc_id},
+                                             **self.session())
+            self.invalidate(doc_id)
+            self.changed()
+            if not res.acknowledged or res.deleted_count == 1:
                 return True
             else:
                 return False
 
+    _bulk_results = staticmethod(bulk_results)
+
+    @staticmethod
+    def _write_errors(exc):
+        return dict((error['index'], error['errmsg'])
+                    for error in exc.details.get('writeErrors', []))
+
+    def _existing_ids(self, doc_ids):
+        cursor = self.collection.find({'_id': {'$in': doc_ids}},
+                                      projection=['_id'], **self.session())
+        return set(doc['_id'] for doc in cursor)
+
+    def bulk_create(self, new_docs):
+        """Insert ``new_docs`` with a single block of ids.
+
+        Returns one result per item, ``{'_id': id, 'ok': True}``, or with
+        ``ok`` False and an ``error`` message if that item was rejected.
+        """
+        if not new_docs:
+            return []
+        doc_ids = self.driver.get_ids(self.__collection__, len(new_docs))
+        for new_doc, doc_id in zip(new_docs, doc_ids):
+            new_doc['_id'] = doc_id
+        errors = {}
+        try:
+            self.collection.insert_many(new_docs, ordered=False,
+                                        **self.session())
+        except pymongo.errors.BulkWriteError as exc:
+            errors = self._write_errors(exc)
+        self.changed()
+        return self._bulk_results(doc_ids, errors)
+
+    def bulk_update(self, new_docs):
+        """``$set`` every document of ``new_docs`` by its ``_id`` key.
+
+        Returns one result per item, see :meth:`bulk_create`.
+        """
+        if not new_docs:
+            return []
+        doc_ids = [int(new_doc.pop('_id')) for new_doc in new_docs]
+        found = self._existing_ids(doc_ids)
+        requests = []
+        for doc_id, new_doc in zip(doc_ids, new_docs):
+            document = {'$set': new_doc}
+            if self.version_field:
+                new_doc.pop(self.version_field, None)
+                document['$inc'] = {self.version_field: 1}
+            requests.append(UpdateOne({'_id': doc_id}, document))
+        errors = {}
+        try:
+            self.collection.bulk_write(requests, ordered=False,
+                                       **self.session())
+        except pymongo.errors.BulkWriteError as exc:
+            errors = self._write_errors(exc)
+        self.invalidate(*doc_ids)
+        self.changed()
+        return self._bulk_results(doc_ids, errors, found)
+
+    def bulk_delete(self, doc_ids):
+        """Delete every document in ``doc_ids`` with one ``delete_many``.
+
+        Returns one result per item, see :meth:`bulk_create`.
+        """
+        if not doc_ids:
+            return []
+        doc_ids = [int(doc_id) for doc_id in doc_ids]
+        found = self._existing_ids(doc_ids)
+        self.collection.delete_many({'_id': {'$in': doc_ids}},
+                                    **self.session())
+        self.invalidate(*doc_ids)
+        self.changed()
+        return self._bulk_results(doc_ids, {}, found)
+
     def __getattr__(self, name):
         attr = getattr(self.collection, name)
         if not attr:
@@ -1,17 +1,621 @@
 # coding=utf-8
 
+import operator
+import threading
+
+import sqlalchemy
+from sqlalchemy import Column, Integer, String, Table, and_, or_, bindparam, \
+    case, func, literal, true
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 
+import six
+
+from ..cache import LRUCache
+from ..exceptions import UnknownField
+from .base import BlockAllocator, bulk_results
+
+SQLALCHEMY_VERSION = tuple(int(part) for part in
+                           sqlalchemy.__version__.split('.')[:2])
+
+# config suffix and create_engine keyword of the pool options.
+POOL_OPTIONS = (
+    ('POOL_SIZE', 'pool_size'),
+    ('MAX_OVERFLOW', 'max_overflow'),
+    ('POOL_TIMEOUT', 'pool_timeout'),
+    ('POOL_RECYCLE', 'pool_recycle'),
+    ('POOL_PRE_PING', 'pool_pre_ping'),
+)
+
+OPERATORS = {
+    '$eq': operator.eq,
+    '$ne': operator.ne,
+    '$gt': operator.gt,
+    '$gte': operator.ge,
+    '$lt': operator.lt,
+    '$lte': operator.le,
+}
+
+REGEX_SPECIAL = set('.^$*+?{}[]|()')
+
+
+def select(columns):
+    if SQLALCHEMY_VERSION < (1, 4):
+        return sqlalchemy.select(columns)
+    return sqlalchemy.select(*columns)
+
+
+def case_of(whens):
+    if SQLALCHEMY_VERSION < (1, 4):
+        return case(whens)
+    return case(*whens)
+
+
+def row_dict(row):
+    return dict(getattr(row, '_mapping', row))
+
+
+def regex_prefix(pattern):
+    """Return the literal prefix an anchored ``^prefix`` regex matches.
+
+    Raises ValueError for any other regex, which SQL cannot run.
+    """
+    if not pattern.startswith('^'):
+        raise ValueError('Only anchored prefix regexes are supported.')
+    prefix = []
+    chars = iter(pattern[1:])
+    for char in chars:
+        if char == '\\':
+            char = next(chars, '')
+        elif char in REGEX_SPECIAL:
+            raise ValueError('Only anchored prefix regexes are supported.')
+        prefix.append(char)
+    return ''.join(prefix)
+
+
+class SQLIDAllocator(BlockAllocator):
+    """:class:`~flask_seed.drivers.base.BlockAllocator` reserving its
+    blocks in the ``ids`` table of a :class:`SQLDriver`."""
+
+    def _reserve(self, size):
+        return self.ids.reserve_ids(self.name, size)
+
 
 class SQLDriver(SQLAlchemy):
-    """SQLDRIVER"""
+    """SQL database driver built on SQLAlchemy Core.
+
+    The database is ``PREFIX_URI`` or ``SQLALCHEMY_DATABASE_URI``, where
+    "PREFIX" defaults to "SQL"; ``sqlite://`` is enough to run locally.
+    The connection pool is tuned with ``PREFIX_POOL_SIZE``,
+    ``PREFIX_MAX_OVERFLOW``, ``PREFIX_POOL_TIMEOUT``, ``PREFIX_POOL_RECYCLE``
+    and ``PREFIX_POOL_PRE_PING``. Ids come from the ``ids`` table in blocks
+    of ``PREFIX_ID_BLOCK_SIZE`` refilled at ``PREFIX_ID_LOW_WATER``, as with
+    the Mongo driver, so bulk inserts know their ids.
+    ``PREFIX_STATEMENT_CACHE_SIZE`` bounds the compiled statements kept per
+    process (SQLAlchemy 1.4 caches them itself).
+    """
+
+    def __init__(self, app=None, config_prefix='SQL', **kwargs):
+        self.config_prefix = config_prefix
+        self.col_classes = []
+        self.id_allocators = {}
+        self._ids_lock = threading.Lock()
+        super(SQLDriver, self).__init__(app, **kwargs)
+        self.ids = Table('ids', self.metadata,
+                         Column('name', String(255), primary_key=True),
+                         Column('id', Integer, nullable=False))
+
+    def init_app(self, app):
+        def key(suffix):
+            return '%s_%s' % (self.config_prefix, suffix)
 
-    def init_db():
-        self.create_all()
+        if key('URI') in app.config:
+            app.config['SQLALCHEMY_DATABASE_URI'] = app.config[key('URI')]
+        app.config.setdefault('SQLALCHEMY_TRACK_MODIFICATIONS', False)
+        options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+        for suffix, option in POOL_OPTIONS:
+            value = app.config.setdefault(key(suffix), None)
+            if value is not None:
+                options[option] = value
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
 
-    def drop_db():
+        self.id_block_size = app.config.setdefault(key('ID_BLOCK_SIZE'), 100)
+        self.id_low_water = app.config.setdefault(key('ID_LOW_WATER'), None)
+        self.compiled_cache = None
+        if SQLALCHEMY_VERSION < (1, 4):
+            self.compiled_cache = LRUCache(
+                app.config.setdefault(key('STATEMENT_CACHE_SIZE'), 512))
+        super(SQLDriver, self).init_app(app)
+
+    def connect(self, begin=False):
+        """Return a pooled connection, in a transaction if ``begin``.
+
+        Use it as a context manager, the connection goes back to the pool
+        when the block ends.
+        """
+        engine = self.engine
+        return engine.begin() if begin else engine.connect()
+
+    def prepare(self, connection):
+        """Let ``connection`` reuse the compiled form of cached statements."""
+        if self.compiled_cache is None:
+            return connection
+        return connection.execution_options(
+            compiled_cache=self.compiled_cache)
+
+    def init_db(self, dry_run=False, **kwargs):
+        """Create the missing tables, return ``{'tables': [names]}``."""
+        existing = set(sqlalchemy.inspect(self.engine).get_table_names())
+        missing = [table.name for table in self.metadata.sorted_tables
+                   if table.name not in existing]
+        if missing and not dry_run:
+            self.create_all()
+        return dict(tables=missing)
+
+    def drop_db(self):
         self.drop_all()
 
+    def after_fork(self):
+        """Forget the pooled connections inherited through fork()."""
+        try:
+            self.engine.dispose(close=False)
+        except TypeError:
+            # SQLAlchemy < 1.4.33 has no close argument.
+            self.engine.pool = self.engine.pool.recreate()
+        self.id_allocators = {}
+
+    def register(self, models):
+        for model in models:
+            self.col_classes.append(model)
+            setattr(self, model.__name__, model(self))
+
+    def reserve_ids(self, name, size):
+        """Reserve ``size`` ids of ``name``, return them as [start, end)."""
+        ids = self.ids.c
+        increment = self.ids.update().where(ids.name == name).values(
+            id=ids.id + size)
+        for attempt in range(2):
+            try:
+                with self.connect(begin=True) as conn:
+                    if conn.execute(increment).rowcount == 0:
+                        conn.execute(self.ids.insert(),
+                                     dict(name=name, id=size))
+                    end = conn.execute(
+                        select([ids.id]).where(ids.name == name)).scalar()
+                    return [end - size + 1, end + 1]
+            except IntegrityError:
+                # another process inserted the counter first.
+                if attempt:
+                    raise
+
+    def get_allocator(self, table):
+        allocator = self.id_allocators.get(table)
+        if allocator is None:
+            block_size = self.id_block_size
+            for cls in self.col_classes:
+                if cls.table_name() == table and cls.id_block_size:
+                    block_size = cls.id_block_size
+            with self._ids_lock:
+                allocator = self.id_allocators.setdefault(
+                    table,
+                    SQLIDAllocator(self, table, block_size, self.id_low_water)
+                )
+        return allocator
+
+    def get_ids(self, table, count):
+        return self.get_allocator(table).take(count)
+
+    def get_id(self, table):
+        return self.get_ids(table, 1)[0]
+
+
+class SQLCursor(object):
+    """A lazy SELECT with the part of pymongo's Cursor handlers use.
+
+    Nothing runs until the cursor is iterated or counted.
+    """
+
+    def __init__(self, model, filter=None, projection=None, sort=None,
+                 skip=0, limit=0):
+        self.model = model
+        self.filter = filter
+        self.projection = projection
+        self._sort = []
+        self._skip = skip
+        self._limit = limit
+        if sort:
+            self.sort(sort)
+
+    def sort(self, key_or_list, direction=1):
+        if isinstance(key_or_list, six.string_types):
+            key_or_list = [(key_or_list, direction)]
+        self._sort = list(key_or_list)
+        return self
+
+    def skip(self, skip):
+        self._skip = skip
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size):
+        return self
+
+    def statement(self, with_limit_and_skip=True):
+        model = self.model
+        statement = select(model.columns_of(self.projection)).where(
+            model.where(self.filter))
+        for key, direction in self._sort:
+            column = model.column(key)
+            statement = statement.order_by(
+                column.desc() if direction == -1 else column.asc())
+        if with_limit_and_skip:
+            if self._limit:
+                statement = statement.limit(self._limit)
+            if self._skip:
+                statement = statement.offset(self._skip)
+        return statement
+
+    def count(self, with_limit_and_skip=False):
+        statement = self.statement(with_limit_and_skip)
+        if not with_limit_and_skip:
+            statement = statement.order_by(None)
+        statement = select([func.count()]).select_from(statement.alias())
+        with self.model.driver.connect() as conn:
+            return conn.execute(statement).scalar()
+
+    def __iter__(self):
+        with self.model.driver.connect() as conn:
+            for row in conn.execute(self.statement()):
+                yield row_dict(row)
+
 
 class SQLBase(object):
-    pass
+    """Base class for SQL tables, with the model contract of MongoBase.
+
+    Example:
+        class Customer(SQLBase):
+
+            __tablename__ = 'customers'
+            columns = [
+                Column('name', String(64), nullable=False),
+                Column('user_id', Integer, index=True),
+            ]
+
+    Every table gets an integer ``_id`` primary key, given out as in
+    MongoBase. Filters are the Mongo style documents handlers build:
+    plain values, $eq, $ne, $gt, $gte, $lt, $lte, $in, $nin, $exists,
+    anchored prefix $regex, $and and $or; anything else is a ValueError,
+    and so is an unknown column (an :class:`UnknownField`). Read options
+    given to :meth:`with_options` are ignored.
+    Statements used by get, create, update and delete are built once and
+    their compiled form reused.
+
+    dbref maps columns holding ids of other rows to their model, as in
+    MongoBase.
+
+    id_block_size overrides SQL_ID_BLOCK_SIZE for this table.
+    version_field names an integer column update() increments.
+    """
+
+    __tablename__ = ''
+    columns = []
+    dbref = {}
+    id_block_size = None
+    version_field = None
+    track_changes = False
+
+    _bulk_results = staticmethod(bulk_results)
+
+    def __init__(self, driver=None):
+        self.driver = driver if driver is not None \
+            else current_app.db_driver
+        columns = [getattr(column, '_copy', None) or column.copy
+                   for column in self.columns]
+        self.table = Table(
+            self.table_name(), self.driver.metadata,
+            Column('_id', Integer, primary_key=True, autoincrement=False),
+            *[make() for make in columns])
+        self._statements = LRUCache(256)
+
+    def with_options(self, read_preference=None, read_concern=None,
+                     write_concern=None):
+        """Return the model itself, SQL has no per query read options."""
+        return self
+
+    @classmethod
+    def table_name(cls):
+        return cls.__tablename__ or cls.__name__.lower()
+
+    def column(self, name):
+        try:
+            return self.table.c[name]
+        except KeyError:
+            raise UnknownField(resource=self.table_name(), field=name)
+
+    def check_columns(self, doc):
+        for name in doc:
+            self.column(name)
+
+    def columns_of(self, projection=None):
+        """Return the columns a find() style ``projection`` selects."""
+        columns = self.table.c
+        if projection is None:
+            return list(columns)
+        if not isinstance(projection, dict):
+            projection = dict((key, 1) for key in projection)
+        keys = [key for key, value in six.iteritems(projection)
+                if value and key != '_id']
+        if keys or (len(projection) == 1 and projection.get('_id')):
+            names = ['_id'] if projection.get('_id', 1) else []
+            names.extend(keys)
+        else:
+            names = [column.name for column in columns
+                     if projection.get(column.name, 1)]
+        return [columns[name] for name in names if name in columns]
+
+    def where(self, filter):
+        """Translate a Mongo style ``filter`` to a SQL clause."""
+        clauses = []
+        for key, value in six.iteritems(filter or {}):
+            if key in ('$and', '$or'):
+                join = and_ if key == '$and' else or_
+                clauses.append(join(*[self.where(f) for f in value]))
+                continue
+            column = self.column(key)
+            if isinstance(value, dict) and value and \
+                    all(op.startswith('$') for op in value):
+                for op, arg in six.iteritems(value):
+                    clauses.append(self.condition(column, op, arg))
+            else:
+                clauses.append(column == value)
+        if not clauses:
+            return true()
+        return and_(*clauses)
+
+    def condition(self, column, op, arg):
+        if op in OPERATORS:
+            return OPERATORS[op](column, arg)
+        if op == '$in':
+            return column.in_(list(arg))
+        if op == '$nin':
+            return ~column.in_(list(arg))
+        if op == '$exists':
+            return column.isnot(None) if arg else column.is_(None)
+        if op == '$regex':
+            return column.startswith(regex_prefix(arg), autoescape=True)
+        raise ValueError('Operator {} is not supported.'.format(op))
+
+    def statement(self, key, build):
+        """Return the statement cached under ``key``, built on first use."""
+        statement = self._statements.get(key)
+        if statement is None:
+            statement = build()
+            self._statements.set(key, statement)
+        return statement
+
+    @staticmethod
+    def projection_key(projection):
+        if isinstance(projection, dict):
+            return tuple(sorted(projection.items()))
+        return tuple(projection) if projection is not None else None
+
+    def select_one(self, conn, doc_id, projection=None):
+        statement = self.statement(
+            ('get', self.projection_key(projection)),
+            lambda: select(self.columns_of(projection)).where(
+                self.table.c._id == bindparam('doc_id')))
+        row = self.driver.prepare(conn).execute(
+            statement, dict(doc_id=doc_id)).first()
+        return row_dict(row) if row is not None else None
+
+    def get_version(self, doc_id):
+        """Return the version of a row, None if it does not exist."""
+        doc = self.get(doc_id, projection=[self.version_field])
+        if doc is None:
+            return None
+        return doc.get(self.version_field) or 0
+
+    def query(self, filter=None, sort=None, projection=None,
+              skip=0, limit=0, **kwargs):
+        return SQLCursor(self, filter=filter, projection=projection,
+                         sort=sort, skip=skip, limit=limit)
+
+    def count(self, filter=None, **kwargs):
+        statement = select([func.count()]).select_from(self.table).where(
+            self.where(filter))
+        with self.driver.connect() as conn:
+            return conn.execute(statement).scalar()
+
+    def estimated_count(self):
+        return self.count()
+
+    def bucket_totals(self, field, boundaries, filter=None,
+                      value_field=None, op='sum'):
+        """Count the rows per range of ``field`` with one GROUP BY, as
+        :meth:`MongoBase.bucket_totals` does."""
+        column = self.column(field)
+        bucket = case_of([
+            (and_(column >= begin, column < end), literal(begin))
+            for begin, end in zip(boundaries, boundaries[1:])]).label(
+                'bucket')
+        columns = [bucket, func.count().label('count')]
+        if value_field:
+            aggregate = func.sum if op == 'sum' else func.avg
+            columns.append(aggregate(self.column(value_field)).label(op))
+        statement = select(columns).where(and_(
+            self.where(filter), column >= boundaries[0],
+            column < boundaries[-1])).group_by(bucket)
+        totals = {}
+        with self.driver.connect() as conn:
+            for row in conn.execute(statement):
+                total = row_dict(row)
+                totals[total.pop('bucket')] = total
+        return totals
+
+    def get(self, doc_id, projection=None):
+        with self.driver.connect() as conn:
+            return self.select_one(conn, int(doc_id), projection)
+
+    def get_many(self, doc_ids, projection=None):
+        """Return ``{_id: row}`` of ``doc_ids`` read with one query."""
+        cursor = self.query({'_id': {'$in': list(doc_ids)}},
+                            projection=projection)
+        return dict((doc['_id'], doc) for doc in cursor)
+
+    def create(self, new_doc):
+        self.check_columns(new_doc)
+        new_doc['_id'] = self.driver.get_id(self.table_name())
+        with self.driver.connect(begin=True) as conn:
+            self.driver.prepare(conn).execute(self.table.insert(), new_doc)
+        return new_doc
+
+    def update_statement(self, names):
+        def build():
+            values = dict((name, bindparam('value_' + name))
+                          for name in names)
+            if self.version_field:
+                version = self.table.c[self.version_field]
+                values[self.version_field] = func.coalesce(version, 0) + 1
+            return self.table.update().where(
+                self.table.c._id == bindparam('doc_id')).values(**values)
+
+        return self.statement(('update', names), build)
+
+    def update_params(self, doc_id, new_doc):
+        params = dict(('value_' + name, value)
+                      for name, value in six.iteritems(new_doc))
+        params['doc_id'] = doc_id
+        return params
+
+    def update(self, doc_id, new_doc, unset=None, projection=None,
+               return_document=True):
+        """Update a row, return it as ``projection`` shapes it.
+
+        ``unset`` columns are set to NULL. Without ``return_document`` the
+        result is just ``{'_id': doc_id}``. None means the row does not
+        exist.
+        """
+        doc_id = int(doc_id)
+        new_doc = dict(new_doc)
+        if self.version_field:
+            new_doc.pop(self.version_field, None)
+        for name in unset or ():
+            new_doc[name] = None
+        self.check_columns(new_doc)
+        with self.driver.connect(begin=True) as conn:
+            conn = self.driver.prepare(conn)
+            if new_doc or self.version_field:
+                statement = self.update_statement(tuple(sorted(new_doc)))
+                found = conn.execute(
+                    statement, self.update_params(doc_id, new_doc)).rowcount
+                if not found:
+                    return None
+                if not return_document:
+                    return {'_id': doc_id}
+            elif not return_document:
+                exists = self.select_one(conn, doc_id, ['_id'])
+                return {'_id': doc_id} if exists else None
+            return self.select_one(conn, doc_id, projection)
+
+    def delete(self, doc_id):
+        statement = self.statement(
+            'delete', lambda: self.table.delete().where(
+                self.table.c._id == bindparam('doc_id')))
+        with self.driver.connect(begin=True) as conn:
+            res = self.driver.prepare(conn).execute(
+                statement, dict(doc_id=int(doc_id)))
+        return res.rowcount == 1
+
+    def existing_ids(self, doc_ids):
+        statement = select([self.table.c._id]).where(
+            self.table.c._id.in_(doc_ids))
+        with self.driver.connect() as conn:
+            return set(row[0] for row in conn.execute(statement))
+
+    def execute_many(self, statement, rows):
+        """Run ``statement`` for every params dict of ``rows`` with one
+        executemany in one transaction.
+
+        If that fails, every row runs in its own transaction instead and
+        the errors are returned by row index.
+        """
+        try:
+            with self.driver.connect(begin=True) as conn:
+                self.driver.prepare(conn).execute(statement, rows)
+            return {}
+        except DBAPIError:
+            pass
+        errors = {}
+        for index, row in enumerate(rows):
+            try:
+                with self.driver.connect(begin=True) as conn:
+                    self.driver.prepare(conn).execute(statement, row)
+            except DBAPIError as e:
+                errors[index] = str(e.orig)
+        return errors
+
+    def bulk_create(self, new_docs):
+        """Insert ``new_docs`` with one executemany INSERT.
+
+        Returns one result per item, ``{'_id': id, 'ok': True}``, or with
+        ``ok`` False and an ``error`` message if that item was rejected.
+        """
+        if not new_docs:
+            return []
+        for new_doc in new_docs:
+            self.check_columns(new_doc)
+        doc_ids = self.driver.get_ids(self.table_name(), len(new_docs))
+        for new_doc, doc_id in zip(new_docs, doc_ids):
+            new_doc['_id'] = doc_id
+        # executemany needs the same keys in every row.
+        names = set()
+        for new_doc in new_docs:
+            names.update(new_doc)
+        rows = [dict((name, new_doc.get(name)) for name in names)
+                for new_doc in new_docs]
+        errors = self.execute_many(self.table.insert(), rows)
+        return self._bulk_results(doc_ids, errors)
+
+    def bulk_update(self, new_docs):
+        """Update every row of ``new_docs`` by its ``_id`` key, with one
+        executemany UPDATE per set of columns.
+
+        Returns one result per item, see :meth:`bulk_create`.
+        """
+        if not new_docs:
+            return []
+        doc_ids = [int(new_doc.pop('_id')) for new_doc in new_docs]
+        found = self.existing_ids(doc_ids)
+        groups = {}
+        for index, (doc_id, new_doc) in enumerate(zip(doc_ids, new_docs)):
+            if self.version_field:
+                new_doc.pop(self.version_field, None)
+            self.check_columns(new_doc)
+            names = tuple(sorted(new_doc))
+            groups.setdefault(names, []).append(
+                (index, self.update_params(doc_id, new_doc)))
+        errors = {}
+        for names, items in six.iteritems(groups):
+            failed = self.execute_many(self.update_statement(names),
+                                       [params for index, params in items])
+            for position, error in six.iteritems(failed):
+                errors[items[position][0]] = error
+        return self._bulk_results(doc_ids, errors, found)
+
+    def bulk_delete(self, doc_ids):
+        """Delete every row in ``doc_ids`` with one DELETE.
+
+        Returns one result per item, see :meth:`bulk_create`.
+        """
+        if not doc_ids:
+            return []
+        doc_ids = [int(doc_id) for doc_id in doc_ids]
+        found = self.existing_ids(doc_ids)
+        with self.driver.connect(begin=True) as conn:
+            conn.execute(self.table.delete().where(
+                self.table.c._id.in_(doc_ids)))
+        return self._bulk_results(doc_ids, {}, found)
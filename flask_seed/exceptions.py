@@ -70,12 +70,23 @@ class IDNotInt(DBError):
     message = 'ID must be integer.'
 
 
+class UnknownField(DBError, ValueError):
+    """Field the model does not have."""
+    message = '%(resource)s has no %(field)s field.'
+
+
 class HTTPError(ProjectException):
     status_code = 400
 
     def to_dict(self):
         return {'message': self.msg}
 
+    def get_headers(self):
+        headers = {}
+        if self.kwargs.get('retry_after') is not None:
+            headers['Retry-After'] = str(self.kwargs['retry_after'])
+        return headers
+
 
 class HTTPBadRequest(HTTPError):
     status_code = 400
@@ -102,12 +113,23 @@ class HTTPMethodNotAllowed(HTTPError):
     message = '405 Method Not Allowed.'
 
 
+class HTTPTooManyRequests(HTTPError):
+    status_code = 429
+    message = '429 Too Many Requests.'
+
+
 class HTTPInternalServerError(HTTPError):
     status_code = 500
     message = '500 Internal Server Error.'
 
 
+class HTTPServiceUnavailable(HTTPError):
+    status_code = 503
+    message = '503 Service Unavailable.'
+
+
 def handle_http_error(error):
     response = jsonify(error.to_dict())
     response.status_code = error.status_code
+    response.headers.extend(error.get_headers())
     return response
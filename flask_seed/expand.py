@@ -0,0 +1,179 @@
+# coding=utf-8
+
+import six
+
+try:
+    import gevent
+    from gevent import monkey
+except ImportError:
+    gevent = None
+
+from flask import copy_current_request_context, g, has_request_context
+
+from .cache import LRUCache
+from .profiling import current_timings
+
+
+def expanded_key(field):
+    """Return the key a referenced document is spliced in under:
+    ``user_id`` gets ``user``, any other field ``<field>_ref``."""
+    if field.endswith('_id') and len(field) > 3:
+        return field[:-3]
+    return field + '_ref'
+
+
+class Expander(object):
+    """Resolve the ``dbref`` fields of documents in batches.
+
+    ``expand=user_id,order_id.customer_id`` names the references to
+    resolve, dotted paths follow the dbref of the referenced model, at
+    most ``max_depth`` levels deep. At each level the ids of all documents
+    are collected and every referenced model is read with one ``$in``
+    query. The queries of a level run in concurrent greenlets only when
+    gevent has patched the socket module, so they really overlap, and
+    the request has no causally consistent session, which they must run
+    in one after the other. Each referenced document, or None if it is
+    missing, is spliced in next to the id (see :func:`expanded_key`); a
+    list of ids gets a list of documents.
+
+    ``projections`` maps a path to the fields returned for it, and a
+    level may reference at most ``max_ids`` distinct ids per model, or
+    a ValueError is raised, so expansion cannot blow up responses.
+    """
+
+    def __init__(self, driver, model, max_depth=1, max_ids=1000,
+                 projections=None, concurrent=True, cache_size=256):
+        self.driver = driver
+        self.model = model
+        self.max_depth = max_depth
+        self.max_ids = max_ids
+        self.projections = projections or {}
+        self.concurrent = concurrent
+        self._trees = LRUCache(cache_size)
+
+    def parse(self, expand):
+        """Return the tree of paths of an ``expand`` parameter value.
+
+        Raises ValueError for fields that are not references and paths
+        deeper than ``max_depth``.
+        """
+        tree = self._trees.get(expand)
+        if tree is not None:
+            return tree
+        tree = {}
+        for path in expand.split(','):
+            if not path:
+                continue
+            fields = path.split('.')
+            if len(fields) > self.max_depth:
+                raise ValueError('Cannot expand more than {} levels.'.format(
+                    self.max_depth))
+            model, node = self.model, tree
+            for field in fields:
+                ref = getattr(model, 'dbref', {}).get(field)
+                if ref is None:
+                    raise ValueError('Cannot expand {}.'.format(field))
+                model = getattr(self.driver, ref)
+                node = node.setdefault(field, {})
+        self._trees.set(expand, tree)
+        return tree
+
+    def projection(self, path, subtree):
+        projection = self.projections.get(path)
+        if projection is None:
+            return None
+        # the references expanded below must be read too.
+        return list(projection) + [field for field in subtree
+                                   if field not in projection]
+
+    def concurrent_io(self):
+        if not self.concurrent or gevent is None or \
+                not monkey.is_module_patched('socket'):
+            return False
+        return not (has_request_context() and
+                    g.get('seed_read_your_writes'))
+
+    @staticmethod
+    def in_request(call, timings):
+        # greenlets get their own contexts; share the request's timings.
+        @copy_current_request_context
+        def run():
+            if timings is not None:
+                g._seed_timings = timings
+            return call()
+
+        return run
+
+    def run(self, calls):
+        if len(calls) < 2 or not self.concurrent_io():
+            return [call() for call in calls]
+        if has_request_context():
+            timings = current_timings()
+            calls = [self.in_request(call, timings) for call in calls]
+        jobs = [gevent.spawn(call) for call in calls]
+        gevent.joinall(jobs, raise_error=True)
+        return [job.value for job in jobs]
+
+    def expand(self, docs, tree):
+        """Splice the references of ``tree`` into ``docs`` in place."""
+        level = [(docs, self.model, tree, '')]
+        while level:
+            # (model name, projection) -> ids, and what to splice where.
+            lookups, splices = {}, []
+            for batch, model, tree, prefix in level:
+                for field, subtree in six.iteritems(tree):
+                    path = prefix + field
+                    projection = self.projection(path, subtree)
+                    key = (model.dbref[field],
+                           tuple(projection) if projection else None)
+                    ids = lookups.setdefault(key, set())
+                    for doc in batch:
+                        value = doc.get(field)
+                        if isinstance(value, list):
+                            ids.update(value)
+                        elif value is not None:
+                            ids.add(value)
+                    splices.append((batch, field, subtree, path, key))
+            for (name, projection), ids in six.iteritems(lookups):
+                if len(ids) > self.max_ids:
+                    raise ValueError('Cannot expand more than {0} {1}.'.format(
+                        self.max_ids, name))
+            keys = list(lookups)
+            found = dict(zip(keys, self.run([
+                self.lookup(name, projection, lookups[(name, projection)])
+                for name, projection in keys])))
+
+            level = []
+            for batch, field, subtree, path, key in splices:
+                refs = found[key]
+                children = []
+                for doc in batch:
+                    value = doc.get(field)
+                    if isinstance(value, list):
+                        ref = [self.copy(refs.get(_id)) for _id in value]
+                        children.extend(child for child in ref if child)
+                    else:
+                        ref = self.copy(refs.get(value))
+                        if ref:
+                            children.append(ref)
+                    doc[expanded_key(field)] = ref
+                if subtree and children:
+                    model = getattr(self.driver, key[0])
+                    level.append((children, model, subtree, path + '.'))
+        return docs
+
+    @staticmethod
+    def copy(doc):
+        # a document referenced twice is spliced in as two dicts, so the
+        # next level can expand each of them.
+        return dict(doc) if doc is not None else None
+
+    def lookup(self, name, projection, ids):
+        model = getattr(self.driver, name)
+
+        def call():
+            if not ids:
+                return {}
+            return model.get_many(list(ids), projection=projection)
+
+        return call
@@ -1,11 +1,29 @@
 # coding=utf-8
 
-from flask import blueprints, make_response, request, \
-    jsonify, current_app as app
+import hashlib
+from datetime import datetime
+from functools import wraps
 
+from bson import ObjectId
+from flask import blueprints, g, make_response, request, \
+    stream_with_context, current_app as app
+import six
+
+from flask_seed import when
+from flask_seed.admission import Admission
+from flask_seed.cache import LRUCache
+from flask_seed.compress import Compressor
+from flask_seed.expand import Expander
+from flask_seed.profiling import timed
+from flask_seed.query import QueryCompiler
 from flask_seed.exceptions import HTTPNotFound, HTTPBadRequest, \
-    HTTPInternalServerError
-from flask_seed.utils import parse_params, remove_dict_item, dumps, LOG
+    HTTPInternalServerError, UnknownField
+from flask_seed.utils import parse_params, remove_dict_item, dumps, \
+    iterdumps, json_response, encode_token, decode_token, project, LOG
+
+# values an after token may hold, so no operator gets into the filter.
+KEYSET_TYPES = six.string_types + six.integer_types + (
+    float, datetime, ObjectId, type(None))
 
 
 class BaseHandler(object):
@@ -16,12 +34,139 @@ class BaseHandler(object):
         {
             "on_all": "viewAll"
         }
+
+    stream_all sends the on_all array from a generator while the cursor
+    is read, stream_batch_size documents per chunk, instead of building
+    the whole body in memory first.
+
+    count_strategy decides how on_all fills the Total header:
+        exact: count the query, as cursor.count() does.
+        estimated: collection metadata when there is no filter, else exact.
+        cached: exact counts memoized per filter for count_cache_ttl seconds.
+        none: no Total header, a Has-More header tells if a next page exists.
+
+    keyset_pagination pages on_all by keyset_field (an indexed key, _id by
+    default) instead of skip when the request has no page parameter. The
+    Next-After header carries an opaque token to pass as after= for the
+    next page and is missing on the last page. Documents whose
+    keyset_field is null or missing come first. Total is only sent with
+    the first page, and the sort parameter is ignored.
+
+    etag adds ETags and answers a matching If-None-Match with 304: on_get
+    builds them from the model's version_field, on_all from its
+    track_changes counter, so unchanged resources are neither queried in
+    full nor serialized. Versions are read from Mongo, never from the
+    document cache; with several workers, use a shared
+    MONGO_CACHE_BACKEND so on_get bodies are not stale either. on_all
+    sends none when it reads from secondaries without read_your_writes.
+
+    response_projection shapes what on_create and on_update send back, as
+    a find() projection dict: on_update pushes it down to Mongo, on_create
+    picks the fields from the inserted document. A list names the keys
+    both leave out, e.g. ['password'], as on_create always did.
+    update_response 'minimal' answers updates with an empty 204; clients
+    choose per request with a Prefer: return=minimal or
+    return=representation header.
+
+    filter_fields switches on_all to a declared filter grammar, see
+    flask_seed.query.QueryCompiler: only those fields (which should be
+    indexed) and operators are accepted, anything else is a 400. Example:
+        {
+            "user_id": (int, ("eq", "in")),
+            "created": (int, ("gt", "lt")),
+            "name": (six.text_type, ("eq", "prefix"))
+        }
+    sort_fields are the keys the sort parameter may use.
+
+    typical_queries are query strings of the lists clients usually ask for;
+    the explain command checks their plans. By default one query per
+    filter field and per sort field is checked.
+
+    bucket_fields are the timestamp fields the buckets route (the set url
+    followed by /buckets) may group by. It answers with the count, and
+    with sum= or avg= one of bucket_value_fields summed or averaged, of
+    the last number= (at most bucket_max_number) buckets of interval=
+    day, month, quarter or year, newest first, from a single aggregation:
+        GET /orders/buckets?interval=month&number=12&field=created&sum=total
+    The other parameters filter the documents as in on_all. Buckets that
+    have ended are cached, keyed by the filter, as they no longer change;
+    bucket_tz is the tzinfo of their boundaries, None for local time.
+
+    read_preference and read_concern route the reads of on_all, on_get
+    and the buckets route, e.g. 'SECONDARY_PREFERRED' to spread lists
+    over the replica set; writes keep the model's settings, see
+    MongoBase. read_your_writes runs every request of the handler in a
+    causally consistent session, so reads see the writes made before
+    them, in the request or in the one that returned the Operation-Time
+    header the client sends back.
+
+    expand= resolves dbref fields of the model in on_all and on_get, e.g.
+    expand=user_id,order_id.customer_id, with one $in query per
+    referenced model and level, see flask_seed.expand.Expander. Paths may
+    be expand_depth levels deep (0 turns expand off), each level may
+    reference expand_max_ids ids per model, and expand_projections maps
+    a path to the fields sent for it. Expanded responses carry no ETag.
+
+    compression compresses the JSON responses of the handler, streamed
+    ones chunk by chunk, with the first of compression_encodings the
+    client accepts (br and zstd when brotli and zstandard are installed,
+    else gzip), see flask_seed.compress.Compressor. Bodies smaller than
+    compression_min_size bytes are sent uncompressed. compression_levels
+    maps an encoding to its level, e.g. {'gzip': 1}.
+
+    max_concurrent and rate_limit shed load per handler, see
+    flask_seed.admission.Admission: at most max_concurrent of its requests
+    run at once, the next max_queue wait up to queue_timeout seconds and
+    any other is a 503; beyond rate_limit requests a second (rate_burst
+    at once) they are a 429. Both carry a Retry-After header.
+    admission_views limits only some views, e.g. ('on_all',), so cheap
+    ones are not stuck behind scans. The counters are in handler.admission
+    and the profile snapshot.
     """
     model = ''
     member = ''
     create_required_fields = []
     other_fields = []
     permissions = {}
+    stream_all = False
+    stream_batch_size = 100
+    count_strategy = 'exact'
+    count_cache_ttl = 60
+    count_cache_size = 1024
+    keyset_pagination = False
+    keyset_field = '_id'
+    etag = False
+    response_projection = None
+    update_response = 'document'
+    filter_fields = None
+    sort_fields = []
+    typical_queries = []
+    bucket_fields = []
+    bucket_value_fields = []
+    bucket_max_number = 120
+    bucket_tz = None
+    bucket_cache_size = 4096
+    read_preference = None
+    read_concern = None
+    read_your_writes = False
+    expand_depth = 1
+    expand_max_ids = 1000
+    expand_projections = {}
+    expand_concurrent = True
+    compression = False
+    compression_encodings = ('br', 'zstd', 'gzip')
+    compression_min_size = 1024
+    compression_levels = {}
+    max_concurrent = None
+    max_queue = 0
+    queue_timeout = 1.0
+    rate_limit = None
+    rate_burst = None
+    retry_after = 1
+    admission_views = None
+
+    # query parameters of on_buckets, which are not filters.
+    bucket_params = ('interval', 'number', 'field', 'sum', 'avg')
 
     def __init__(self, blueprint_name=None):
         if not blueprint_name:
@@ -29,40 +174,93 @@ class BaseHandler(object):
         self.blueprint = blueprints.Blueprint(blueprint_name, __name__)
 
         self._model = getattr(app.db_driver, self.model)
+        self._reader = self._model
+        if self.read_preference is not None or \
+                self.read_concern is not None:
+            self._reader = self._model.with_options(
+                read_preference=self.read_preference,
+                read_concern=self.read_concern)
+
+        self.admission = None
+        if self.max_concurrent is not None or self.rate_limit:
+            self.admission = Admission(self.max_concurrent, self.max_queue,
+                                       self.queue_timeout, self.rate_limit,
+                                       self.rate_burst, self.retry_after)
+            app.extensions.setdefault('seed_admission', {})[
+                blueprint_name] = self.admission
 
         self.generate_url()
         self.handle_url_route()
 
         self.all_fields = self.create_required_fields + self.other_fields
+        self._count_cache = LRUCache(self.count_cache_size,
+                                     self.count_cache_ttl)
+        self.query_compiler = QueryCompiler(self.filter_fields or {},
+                                            self.sort_fields)
+        self._bucket_cache = LRUCache(self.bucket_cache_size)
+        self.expander = Expander(app.db_driver, self._model,
+                                 self.expand_depth, self.expand_max_ids,
+                                 self.expand_projections,
+                                 self.expand_concurrent)
+        self.compressor = None
+        if self.compression:
+            self.compressor = Compressor(self.compression_encodings,
+                                         self.compression_min_size,
+                                         self.compression_levels)
+            self.blueprint.after_request(self.compress)
 
     def generate_url(self):
         prefix = ''
         self.set_url = '{prefix}/{member}s'.format(
             prefix=prefix, member=self.member)
-        self.member_url = '{set_url}/<{member}_id>'.format(
+        self.member_url = '{set_url}/<int:{member}_id>'.format(
             set_url=self.set_url, member=self.member)
+        self.bulk_url = '{set_url}/bulk'.format(set_url=self.set_url)
+        self.buckets_url = '{set_url}/buckets'.format(set_url=self.set_url)
 
     def _get_resource_id(self, member, **kwargs):
         key = '{}_id'.format(member)
         return int(kwargs.get(key))
 
-    def get_filter(self):
-        params = parse_params()
+    def get_filter(self, ignore=()):
+        if self.filter_fields is None:
+            params = parse_params()
+        else:
+            params = request.args.to_dict()
+        for name in ignore:
+            remove_dict_item(params, name)
         limit = int(remove_dict_item(params, 'limit', 0))
         page = int(remove_dict_item(params, 'page', 1))
         per_page = int(remove_dict_item(params, 'per_page', 0))
         if per_page:
             limit = per_page
         skip = (page - 1) * per_page
+        remove_dict_item(params, 'after')
+        remove_dict_item(params, 'expand')
 
         projection = remove_dict_item(params, 'columns')
         if projection:
             projection = projection.split(',')
-        filter = params
+        if self.sort_fields or self.filter_fields is not None:
+            remove_dict_item(params, 'sort')
+        if self.filter_fields is None:
+            filter = params
+        else:
+            try:
+                filter = self.query_compiler.build_filter(params)
+            except ValueError as e:
+                raise HTTPBadRequest(str(e))
         return filter, limit, skip, projection
 
-    def get_post_data(self, operation=None, resource_id=None):
-        data = request.get_json()
+    def get_sort(self):
+        if not self.sort_fields:
+            return None
+        try:
+            return self.query_compiler.build_sort(request.args.get('sort'))
+        except ValueError as e:
+            raise HTTPBadRequest(str(e))
+
+    def check_post_data(self, data, operation=None):
         if operation == 'create':
             for key in self.create_required_fields:
                 if key not in data:
@@ -74,10 +272,61 @@ class BaseHandler(object):
                     if key not in self.all_fields:
                         err_msg = 'Cannot accept {} filed.'.format(key)
                         raise HTTPBadRequest(err_msg)
+
+    def get_post_data(self, operation=None, resource_id=None):
+        data = request.get_json()
+        self.check_post_data(data, operation)
         return data
 
+    def get_bulk_post_data(self, operation=None):
+        """Return the JSON array of a bulk request, checking every item.
+
+        Items of a bulk update must carry their integer ``_id``, items of
+        a bulk delete are the ids themselves.
+        """
+        data = request.get_json()
+        if not isinstance(data, list):
+            raise HTTPBadRequest('Bulk {} needs a JSON array.'.format(
+                operation))
+        for index, item in enumerate(data):
+            try:
+                if operation == 'delete':
+                    int(item)
+                    continue
+                if not isinstance(item, dict):
+                    raise HTTPBadRequest('Item must be a JSON object.')
+                if operation == 'update':
+                    int(item.get(u'_id'))
+                    item = dict(item)
+                    del item[u'_id']
+                self.check_post_data(item, operation)
+            except (TypeError, ValueError):
+                raise HTTPBadRequest('Item {} needs an integer id.'.format(
+                    index))
+            except HTTPBadRequest as e:
+                raise HTTPBadRequest('Item {0}: {1}'.format(index, e.msg))
+        return data
+
+    @staticmethod
+    def post_projection(projection):
+        # a list names the keys to leave out, as it always did on create.
+        if isinstance(projection, (list, tuple)):
+            return dict((key, 0) for key in projection)
+        return projection
+
     def get_post_projection(self):
-        return None
+        """Return the projection of on_create and on_update, a list of
+        keys to drop becoming a find() exclusion."""
+        return self.post_projection(self.response_projection)
+
+    def return_document(self):
+        """Tell if on_update answers with the updated document."""
+        prefer = request.headers.get('Prefer', '')
+        if 'return=minimal' in prefer:
+            return False
+        if 'return=representation' in prefer:
+            return True
+        return self.update_response != 'minimal'
 
     def get_projection(self):
         projection = request.args.get('columns', None)
@@ -85,65 +334,335 @@ class BaseHandler(object):
             projection = projection.split(',')
         return projection
 
-    def query(self, **kwargs):
+    def explain_queries(self):
+        if self.typical_queries:
+            return list(self.typical_queries)
+        queries = []
+        fields = self.filter_fields or {}
+        for field, (convert, ops) in sorted(fields.items()):
+            try:
+                convert('0')
+            except (TypeError, ValueError):
+                continue
+            op = 'eq' if 'eq' in ops else ops[0]
+            name = field if op == 'eq' else field + '__' + op
+            queries.append('{0}=0'.format(name))
+        for key in self.sort_fields:
+            queries.append('sort={}'.format(key))
+        return queries
+
+    def get_expand(self):
+        """Return the tree of references to expand, None if none."""
+        expand = request.args.get('expand')
+        if not expand:
+            return None
+        try:
+            return self.expander.parse(expand)
+        except ValueError as e:
+            raise HTTPBadRequest(str(e))
+
+    def expand(self, resources, tree):
+        with timed('expand'):
+            try:
+                return self.expander.expand(resources, tree)
+            except ValueError as e:
+                raise HTTPBadRequest(str(e))
+
+    def use_keyset(self):
+        return self.keyset_pagination and 'page' not in request.args
+
+    def keyset_fields(self):
+        if self.keyset_field == '_id':
+            return ['_id']
+        return [self.keyset_field, '_id']
+
+    def keyset_token(self, resource):
+        return encode_token([resource.get(f) for f in self.keyset_fields()])
+
+    def keyset_filter(self, token):
+        """Return the filter selecting documents after ``token``."""
+        try:
+            values = decode_token(token)
+        except ValueError:
+            values = None
+        if not isinstance(values, list) or \
+                len(values) != len(self.keyset_fields()) or \
+                not isinstance(values[-1], six.integer_types) or \
+                isinstance(values[-1], bool) or \
+                not all(isinstance(value, KEYSET_TYPES)
+                        for value in values):
+            raise HTTPBadRequest('Invalid after token.')
+        _id = values[-1]
+        if self.keyset_field == '_id':
+            return {'_id': {'$gt': _id}}
+        key, value = self.keyset_field, values[0]
+        if value is None:
+            # null and missing keys sort first, and $gt None matches none.
+            return {'$or': [{key: {'$ne': None}},
+                            {key: None, '_id': {'$gt': _id}}]}
+        return {'$or': [{key: {'$gt': value}},
+                        {key: value, '_id': {'$gt': _id}}]}
+
+    def get_query(self, **kwargs):
+        """Return the keyword arguments on_all passes to model.query."""
         filter, limit, skip, projection = self.get_filter()
-        resources = self._model.query(
-            filter=filter,
-            limit=limit, skip=skip,
-            projection=projection
-        )
-        return resources
+        query = dict(filter=filter, limit=limit, skip=skip,
+                     projection=projection, sort=self.get_sort())
+        if self.use_keyset():
+            after = request.args.get('after')
+            if after:
+                after = self.keyset_filter(after)
+                query['filter'] = {'$and': [filter, after]} if filter \
+                    else after
+            query['skip'] = 0
+            query['sort'] = [(key, 1) for key in self.keyset_fields()]
+            if isinstance(projection, list):
+                query['projection'] = projection + [
+                    key for key in self.keyset_fields()
+                    if key not in projection]
+        return query
+
+    def query(self, **kwargs):
+        return self._reader.query(**self.get_query(**kwargs))
+
+    def count(self, resources, query, **kwargs):
+        """Return the Total of on_all according to count_strategy.
+
+        Nothing is read from the ``resources`` cursor, so the find itself
+        never runs here.
+        """
+        filter = query['filter']
+        if self.count_strategy == 'estimated' and not filter and \
+                not kwargs:
+            return self._reader.estimated_count()
+        if self.count_strategy == 'cached':
+            key = dumps([filter, kwargs], sort_keys=True)
+            total = self._count_cache.get(key)
+            if total is None:
+                total = resources.count()
+                self._count_cache.set(key, total)
+            return total
+        return resources.count()
+
+    def make_etag(self, *parts):
+        return hashlib.md5(
+            dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def compress(self, response):
+        return self.compressor(request, response)
+
+    def not_modified(self, etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
 
     def on_all(self, **kwargs):
-        resources = self.query(**kwargs)
-        total = resources.count()
+        etag = None
+        expand = self.get_expand()
+        changes = None
+        if self.etag and self._model.track_changes and not expand:
+            # the reader's counter, the body comes from the reader too.
+            changes = self._reader.changes()
+        if changes is not None:
+            etag = self.make_etag(self.member, changes,
+                                  request.args.to_dict(flat=False), kwargs)
+            if request.if_none_match.contains_weak(etag):
+                return self.not_modified(etag)
+
+        with timed('query'):
+            query = self.get_query(**kwargs)
+        resources = self._reader.query(**query)
+        limit = query['limit']
+        keyset = self.use_keyset()
+        headers = {}
+        if self.count_strategy != 'none' and not (
+                keyset and request.args.get('after')):
+            with timed('count'):
+                headers['Total'] = self.count(resources, query, **kwargs)
+
+        if request.method == 'HEAD':
+            if self.count_strategy == 'none':
+                has_more = False
+                if limit:
+                    resources.skip(query['skip'] + limit).limit(1)
+                    has_more = resources.count(with_limit_and_skip=True) > 0
+                headers['Has-More'] = 'true' if has_more else 'false'
+        elif self.count_strategy == 'none' or keyset:
+            # read one document past the page to know if another exists.
+            if limit:
+                resources.limit(limit + 1)
+            with timed('fetch'):
+                resources = list(resources)
+            has_more = bool(limit) and len(resources) > limit
+            if has_more:
+                resources = resources[:limit]
+            if self.count_strategy == 'none':
+                headers['Has-More'] = 'true' if has_more else 'false'
+            if keyset and has_more:
+                headers['Next-After'] = self.keyset_token(resources[-1])
+            columns = self.get_projection()
+            if keyset and columns and self.keyset_field != '_id' and \
+                    self.keyset_field not in columns:
+                for resource in resources:
+                    resource.pop(self.keyset_field, None)
+
+        if expand and request.method != 'HEAD':
+            if not isinstance(resources, list):
+                with timed('fetch'):
+                    resources = list(resources)
+            self.expand(resources, expand)
+
         if request.method == 'HEAD':
             response = make_response()
+        elif self.stream_all and not isinstance(resources, list):
+            resources.batch_size(self.stream_batch_size)
+            body = iterdumps(resources, self.stream_batch_size)
+            response = app.response_class(stream_with_context(body),
+                                          mimetype='application/json')
         else:
-            response = make_response(dumps(resources))
-        response.headers['Total'] = total
+            response = json_response(resources)
+        response.headers.extend(headers)
+        if etag:
+            response.set_etag(etag)
         return response
 
+    def get_bucket_args(self):
+        """Return interval, number, field, op and value field of the
+        buckets request, raising HTTPBadRequest for bad ones."""
+        args = request.args
+        interval = args.get('interval', 'month')
+        if interval not in when.INTERVALS:
+            raise HTTPBadRequest('interval must be one of {}.'.format(
+                ', '.join(when.INTERVALS)))
+        try:
+            number = int(args.get('number', 12))
+        except ValueError:
+            number = 0
+        if not 0 < number <= self.bucket_max_number:
+            raise HTTPBadRequest('number must be between 1 and {}.'.format(
+                self.bucket_max_number))
+        field = args.get('field', self.bucket_fields[0])
+        if field not in self.bucket_fields:
+            raise HTTPBadRequest('Cannot group by {}.'.format(field))
+        op = value_field = None
+        for name in ('sum', 'avg'):
+            if name in args:
+                if op:
+                    raise HTTPBadRequest('Use either sum or avg.')
+                op, value_field = name, args[name]
+                if value_field not in self.bucket_value_fields:
+                    raise HTTPBadRequest('Cannot {0} {1}.'.format(
+                        op, value_field))
+        return interval, number, field, op, value_field
+
+    def on_buckets(self, **kwargs):
+        interval, number, field, op, value_field = self.get_bucket_args()
+        filter = self.get_filter(ignore=self.bucket_params)[0]
+        ranges = when.Time(tz=self.bucket_tz).get_recent_ranges(interval,
+                                                                number)
+        now = when.now()
+        prefix = dumps([field, filter, op, value_field], sort_keys=True)
+
+        totals, missing = {}, []
+        for key, (begin, end) in ranges:
+            total = None
+            if end <= now:
+                total = self._bucket_cache.get((prefix, begin, end))
+            if total is None:
+                missing.append((begin, end))
+            else:
+                totals[begin] = total
+        if missing:
+            # one aggregation over every bucket between the oldest and the
+            # newest missing one, boundaries must be contiguous.
+            low = min(begin for begin, end in missing)
+            high = max(end for begin, end in missing)
+            span = [(begin, end) for key, (begin, end) in ranges
+                    if low <= begin and end <= high]
+            boundaries = sorted(begin for begin, end in span) + [high]
+            found = self._reader.bucket_totals(field, boundaries, filter,
+                                               value_field, op)
+            for begin, end in span:
+                total = found.get(begin)
+                if total is None:
+                    total = {'count': 0}
+                    if op:
+                        total[op] = 0 if op == 'sum' else None
+                totals[begin] = total
+                if end <= now:
+                    self._bucket_cache.set((prefix, begin, end), total)
+
+        buckets = []
+        for key, (begin, end) in ranges:
+            bucket = dict(key=key, begin=begin, end=end)
+            bucket.update(totals[begin])
+            buckets.append(bucket)
+        return json_response(buckets)
+
     def on_get(self, **kwargs):
         resource_id = self._get_resource_id(self.member, **kwargs)
         projection = self.get_projection()
-        resource = self._model.get(resource_id, projection=projection)
+        expand = self.get_expand()
+        version_field = self._model.version_field \
+            if self.etag and not expand else None
+        if version_field and request.if_none_match:
+            version = self._reader.get_version(resource_id)
+            if version is not None:
+                etag = self.make_etag(resource_id, version, projection)
+                if request.if_none_match.contains_weak(etag):
+                    return self.not_modified(etag)
+
+        fetch_projection = projection
+        if version_field and projection and version_field not in projection:
+            fetch_projection = projection + [version_field]
+        resource = self._reader.get(resource_id,
+                                    projection=fetch_projection)
         if not resource:
             err_msg = '{member} {_id} not found.'.format(
                 member=self.member.capitalize(),
                 _id=resource_id
             )
             raise HTTPNotFound(err_msg)
-        return jsonify(resource)
+        if expand:
+            self.expand([resource], expand)
+        if not version_field:
+            return json_response(resource)
+        if fetch_projection is not projection:
+            version = resource.pop(version_field, 0)
+        else:
+            version = resource.get(version_field, 0)
+        response = json_response(resource)
+        response.set_etag(self.make_etag(resource_id, version, projection))
+        return response
 
     def on_create(self, **kwargs):
         resource = self.get_post_data('create')
-        projection = self.get_post_projection()
+        # post_projection again for overrides still returning lists.
+        projection = self.post_projection(self.get_post_projection())
         try:
             new_resource = self._model.create(resource)
+        except UnknownField as e:
+            raise HTTPBadRequest(str(e))
         except Exception as e:
             app.logger.error(e)
             msg = 'Cannot create {0}, {1}.'.format(self.member, str(e))
             raise HTTPInternalServerError(msg)
         else:
-            if isinstance(projection, list):
-                for key in projection:
-                    del new_resource[key]
-            if isinstance(projection, dict):
-                for key, value in projection.iteritems():
-                    if not value:
-                        del new_resource[key]
-            return jsonify(new_resource), 201
+            return json_response(project(new_resource, projection), 201)
 
     def on_update(self, **kwargs):
         resource_id = self._get_resource_id(self.member, **kwargs)
         resource = self.get_post_data('update', resource_id)
-        projection = self.get_post_projection()
+        projection = self.post_projection(self.get_post_projection())
+        return_document = self.return_document()
         if u'_id' in resource:
             del resource[u'_id']
         try:
-            new_resource = self._model.update(resource_id, resource,
-                                              projection=projection)
+            new_resource = self._model.update(
+                resource_id, resource, projection=projection,
+                return_document=return_document)
+        except UnknownField as e:
+            raise HTTPBadRequest(str(e))
         except Exception as e:
             app.logger.error(str(e))
             msg = 'Cannot update {0}, {1}.'.format(self.member, str(e))
@@ -155,7 +674,9 @@ class BaseHandler(object):
             )
             if not new_resource:
                 raise HTTPNotFound(err_msg)
-            return jsonify(new_resource)
+            if not return_document:
+                return '', 204
+            return json_response(new_resource)
 
     def remove_check(self, resource_id):
         pass
@@ -172,13 +693,86 @@ class BaseHandler(object):
         else:
             return '', 204
 
+    def on_bulk_create(self, **kwargs):
+        resources = self.get_bulk_post_data('create')
+        try:
+            results = self._model.bulk_create(resources)
+        except UnknownField as e:
+            raise HTTPBadRequest(str(e))
+        except Exception as e:
+            app.logger.error(e)
+            msg = 'Cannot create {0}s, {1}.'.format(self.member, str(e))
+            raise HTTPInternalServerError(msg)
+        return json_response(results)
+
+    def on_bulk_update(self, **kwargs):
+        resources = self.get_bulk_post_data('update')
+        try:
+            results = self._model.bulk_update(resources)
+        except UnknownField as e:
+            raise HTTPBadRequest(str(e))
+        except Exception as e:
+            app.logger.error(e)
+            msg = 'Cannot update {0}s, {1}.'.format(self.member, str(e))
+            raise HTTPInternalServerError(msg)
+        return json_response(results)
+
+    def on_bulk_delete(self, **kwargs):
+        resource_ids = [int(_id) for _id in self.get_bulk_post_data('delete')]
+        for resource_id in resource_ids:
+            self.remove_check(resource_id)
+        try:
+            results = self._model.bulk_delete(resource_ids)
+        except Exception as e:
+            app.logger.error(e)
+            msg = 'Delete {0}s failed, {1}'.format(self.member, str(e))
+            raise HTTPInternalServerError(msg)
+        return json_response(results)
+
+    def read_own_writes(self, view_func):
+        @wraps(view_func)
+        def view(*args, **kwargs):
+            g.seed_read_your_writes = True
+            return view_func(*args, **kwargs)
+
+        return view
+
+    def admit(self, view_func):
+        admission = self.admission
+
+        @wraps(view_func)
+        def view(*args, **kwargs):
+            with timed('queue'):
+                admission.acquire()
+            try:
+                response = view_func(*args, **kwargs)
+            except Exception:
+                admission.release()
+                raise
+            # streamed bodies still read the database while they are sent.
+            if getattr(response, 'is_streamed', False):
+                response.call_on_close(admission.release)
+            else:
+                admission.release()
+            return response
+
+        return view
+
     def route(self, url, view_func, methods=None):
         if methods is None:
             methods = ['GET']
+        if self.admission is not None and (
+                self.admission_views is None or
+                view_func.__name__ in self.admission_views):
+            view_func = self.admit(view_func)
+        if self.read_your_writes:
+            view_func = self.read_own_writes(view_func)
         self.blueprint.add_url_rule(url, view_func=view_func, methods=methods)
 
     def handle_url_route(self):
         self.route(self.set_url, self.on_all, methods=['GET', 'HEAD'])
+        if self.bucket_fields:
+            self.route(self.buckets_url, self.on_buckets)
         self.route(self.member_url, self.on_get)
         log_create = LOG('Create {}'.format(self.member))
         log_update = LOG('Update {}'.format(self.member))
@@ -186,3 +780,12 @@ class BaseHandler(object):
         self.route(self.set_url, log_create(self.on_create), ['POST'])
         self.route(self.member_url, log_update(self.on_update), ['POST'])
         self.route(self.member_url, log_delete(self.on_delete), ['DELETE'])
+        log_bulk_create = LOG('Bulk create {}'.format(self.member))
+        log_bulk_update = LOG('Bulk update {}'.format(self.member))
+        log_bulk_delete = LOG('Bulk delete {}'.format(self.member))
+        self.route(self.bulk_url, log_bulk_create(self.on_bulk_create),
+                   ['POST'])
+        self.route(self.bulk_url, log_bulk_update(self.on_bulk_update),
+                   ['PUT'])
+        self.route(self.bulk_url, log_bulk_delete(self.on_bulk_delete),
+                   ['DELETE'])
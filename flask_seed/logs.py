@@ -0,0 +1,105 @@
+# coding=utf-8
+
+import atexit
+import logging
+import os
+import time
+from collections import deque
+
+import six
+
+try:
+    from gevent.monkey import get_original
+except ImportError:
+    def get_original(module, name):
+        return getattr(__import__(module), name)
+
+_thread = '_thread' if six.PY3 else 'thread'
+# real OS threads and locks, even when gevent has patched the modules.
+start_new_thread = get_original(_thread, 'start_new_thread')
+allocate_lock = get_original(_thread, 'allocate_lock')
+
+
+class AsyncHandler(logging.Handler):
+    """Log through a background thread.
+
+    Records are queued by :meth:`emit` and formatted and written by
+    ``target`` (e.g. a RotatingFileHandler) in a real OS thread, so disk
+    I/O never blocks a request or the gevent hub. At most ``maxsize``
+    records wait in the queue; when it is full, ``policy`` 'drop' discards
+    the record and counts it in ``dropped``, 'block' waits for room.
+    """
+
+    def __init__(self, target, maxsize=10000, policy='drop'):
+        logging.Handler.__init__(self)
+        if policy not in ('drop', 'block'):
+            raise ValueError('policy must be drop or block.')
+        self.target = target
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self._records = deque()
+        self._wakeup = allocate_lock()
+        self._wakeup.acquire()
+        self._writing = allocate_lock()
+        self._pid = None
+        atexit.register(self.flush)
+
+    @property
+    def queued(self):
+        return len(self._records)
+
+    def _start(self):
+        # a thread does not survive fork(), records queued before it
+        # belong to the parent.
+        self._pid = os.getpid()
+        self._records.clear()
+        start_new_thread(self._run, ())
+
+    def _wake(self):
+        try:
+            self._wakeup.release()
+        except Exception:
+            pass  # already woken up.
+
+    def _run(self):
+        while True:
+            self._wakeup.acquire()
+            self._drain()
+
+    def _drain(self):
+        with self._writing:
+            while True:
+                try:
+                    record = self._records.popleft()
+                except IndexError:
+                    return
+                try:
+                    self.target.handle(record)
+                except Exception:
+                    self.target.handleError(record)
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        # merge the arguments now, they may change once the call returns.
+        record.msg = record.getMessage()
+        record.args = None
+        while len(self._records) >= self.maxsize:
+            if self.policy == 'drop':
+                self.dropped += 1
+                return
+            self._wake()
+            time.sleep(0.001)
+        self._records.append(record)
+        self._wake()
+
+    def flush(self):
+        if self._pid == os.getpid():
+            self._drain()
+        self.target.flush()
+
+    def close(self):
+        self.flush()
+        self.target.close()
+        logging.Handler.close(self)
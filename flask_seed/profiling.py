@@ -0,0 +1,294 @@
+# coding=utf-8
+
+import bisect
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from timeit import default_timer
+
+from flask import g, has_request_context, jsonify, request, \
+    current_app
+from pymongo import monitoring
+
+import six
+
+from .exceptions import HTTPForbidden
+
+
+def _bucket_bounds(lowest=0.01, highest=60000.0, growth=1.1):
+    bounds = []
+    bound = lowest
+    while bound < highest:
+        bounds.append(bound)
+        bound *= growth
+    bounds.append(highest)
+    return bounds
+
+
+# upper bounds in milliseconds, shared by every Histogram.
+BUCKET_BOUNDS = _bucket_bounds()
+
+
+class Histogram(object):
+    """Thread safe latency histogram in milliseconds.
+
+    Values are counted in log spaced buckets, so memory stays the same
+    however many are recorded; percentiles are interpolated within their
+    bucket, which is 10% wide.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, value):
+        index = bisect.bisect_left(BUCKET_BOUNDS, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, percent):
+        rank = self.count * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if index == len(BUCKET_BOUNDS):
+                    break
+                # interpolate within the bucket.
+                lower = BUCKET_BOUNDS[index - 1] if index else 0.0
+                upper = min(BUCKET_BOUNDS[index], self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+    def to_dict(self):
+        with self._lock:
+            if not self.count:
+                return dict(count=0)
+            return dict(count=self.count,
+                        mean=round(self.total / self.count, 3),
+                        p50=round(self.percentile(50), 3),
+                        p95=round(self.percentile(95), 3),
+                        p99=round(self.percentile(99), 3),
+                        max=round(self.max, 3))
+
+
+class Timings(object):
+    """Milliseconds spent in each stage of the current request."""
+
+    def __init__(self):
+        self.start = default_timer()
+        self.stages = OrderedDict()
+
+    def add(self, stage, elapsed):
+        self.stages[stage] = self.stages.get(stage, 0.0) + elapsed
+
+    def total(self):
+        return (default_timer() - self.start) * 1000
+
+
+def current_timings():
+    """Return the Timings of the current request, None if not profiled."""
+    if not has_request_context():
+        return None
+    return getattr(g, '_seed_timings', None)
+
+
+@contextmanager
+def timed(stage):
+    """Add the time spent in the block to ``stage`` of the request.
+
+    Nothing is measured outside a profiled request.
+    """
+    timings = current_timings()
+    if timings is None:
+        yield
+        return
+    start = default_timer()
+    try:
+        yield
+    finally:
+        timings.add(stage, (default_timer() - start) * 1000)
+
+
+def filter_shape(filter):
+    """Replace the values of a query filter with ``1``, keeping its keys.
+
+    ``{'age': {'$gt': 20}, 'tags': {'$in': ['a', 'b']}}`` becomes
+    ``{'age': {'$gt': 1}, 'tags': {'$in': [1]}}``, so queries that only
+    differ by their values look the same in the logs.
+    """
+    if isinstance(filter, dict):
+        return dict((key, filter_shape(value))
+                    for key, value in six.iteritems(filter))
+    if isinstance(filter, (list, tuple)):
+        shapes = []
+        for value in filter:
+            shape = filter_shape(value)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return 1
+
+
+def command_filter(name, command):
+    if name in ('find', 'count', 'distinct', 'findAndModify'):
+        return command.get('filter', command.get('query'))
+    if name in ('update', 'delete'):
+        key = 'updates' if name == 'update' else 'deletes'
+        statements = command.get(key) or [{}]
+        return statements[0].get('q')
+    if name == 'aggregate':
+        pipeline = command.get('pipeline') or [{}]
+        return pipeline[0].get('$match')
+    return None
+
+
+class CommandStats(getattr(monitoring, 'CommandListener', object)):
+    """Mongo command listener timing every command of one client.
+
+    Commands slower than ``slow_ms`` are logged with the shape of their
+    filter. When a :class:`Profiler` is attached, durations are recorded
+    per collection and added to the ``mongo`` stage of the request.
+    """
+
+    def __init__(self, slow_ms=None, logger=None):
+        self.slow_ms = slow_ms
+        self.logger = logger
+        self.profiler = None
+        self._started = {}
+
+    @property
+    def enabled(self):
+        return self.slow_ms is not None or self.profiler is not None
+
+    def started(self, event):
+        name = event.command_name
+        collection = event.command.get(name)
+        if name == 'getMore':
+            collection = event.command.get('collection')
+        if not isinstance(collection, six.string_types):
+            collection = None
+        self._started[event.request_id] = (collection, event.command)
+
+    def _finish(self, event, failed=False):
+        collection, command = self._started.pop(event.request_id,
+                                                (None, None))
+        elapsed = event.duration_micros / 1000.0
+        timings = current_timings()
+        if timings is not None:
+            timings.add('mongo', elapsed)
+        if self.profiler is not None and collection is not None:
+            self.profiler.record_command(collection, event.command_name,
+                                         elapsed)
+        if self.slow_ms is not None and elapsed >= self.slow_ms and \
+                self.logger is not None:
+            shape = filter_shape(command_filter(event.command_name,
+                                                command or {}))
+            self.logger.warning(
+                'Slow mongo %s on %s: %.1f ms%s, filter %s.',
+                event.command_name, collection, elapsed,
+                ' (failed)' if failed else '', shape)
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+
+class Profiler(object):
+    """Time every request and keep latency histograms.
+
+    Handlers time their stages with :func:`timed`, Mongo round trips are
+    timed by the driver's :class:`CommandStats`. The stages go out in a
+    ``Server-Timing`` header unless ``SEED_SERVER_TIMING`` is False, and
+    are recorded per route, with Mongo commands per collection, in
+    :class:`Histogram` instances served as JSON, next to the admission
+    counters of the handlers, at ``SEED_PROFILE_URL`` if it is set, e.g.
+    ``/_seed/profile``. They show the routes and the load of the service,
+    so ``SEED_PROFILE_AUTH``, a function of the request returning whether
+    it may see them, should guard that URL when it is reachable from
+    outside; other requests get a 403. Histograms belong to one process,
+    each worker keeps its own.
+    """
+
+    def __init__(self, app=None, config_prefix='SEED'):
+        self.routes = {}
+        self.collections = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, config_prefix)
+
+    def init_app(self, app, config_prefix='SEED'):
+        def key(suffix):
+            return '%s_%s' % (config_prefix, suffix)
+
+        self.server_timing = app.config.get(key('SERVER_TIMING'), True)
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        self.authorize = app.config.get(key('PROFILE_AUTH'))
+        url = app.config.get(key('PROFILE_URL'))
+        if url:
+            app.add_url_rule(url, 'seed_profile', self.on_profile)
+        app.extensions['seed_profiler'] = self
+        command_stats = getattr(getattr(app, 'db_driver', None),
+                                'command_stats', None)
+        if command_stats is not None:
+            command_stats.profiler = self
+
+    def histogram(self, group, name, stage):
+        stages = group.get(name)
+        if stages is None or stage not in stages:
+            with self._lock:
+                stages = group.setdefault(name, {})
+                stages.setdefault(stage, Histogram())
+        return stages[stage]
+
+    def record_command(self, collection, command_name, elapsed):
+        self.histogram(self.collections, collection,
+                       command_name).record(elapsed)
+
+    def start_request(self):
+        g._seed_timings = Timings()
+
+    def finish_request(self, response):
+        timings = current_timings()
+        if timings is None:
+            return response
+        total = timings.total()
+        rule = request.url_rule.rule if request.url_rule else '<unmatched>'
+        route = '{} {}'.format(request.method, rule)
+        self.histogram(self.routes, route, 'total').record(total)
+        for stage, elapsed in six.iteritems(timings.stages):
+            self.histogram(self.routes, route, stage).record(elapsed)
+        if self.server_timing:
+            metrics = ['{};dur={:.2f}'.format(stage, elapsed)
+                       for stage, elapsed in six.iteritems(timings.stages)]
+            metrics.append('total;dur={:.2f}'.format(total))
+            response.headers['Server-Timing'] = ', '.join(metrics)
+        return response
+
+    def snapshot(self):
+        def dump(group):
+            return dict((name, dict((stage, hist.to_dict())
+                                    for stage, hist in list(stages.items())))
+                        for name, stages in list(group.items()))
+
+        admission = current_app.extensions.get('seed_admission', {})
+        return dict(pid=os.getpid(), routes=dump(self.routes),
+                    collections=dump(self.collections),
+                    admission=dict((name, limiter.stats()) for name, limiter
+                                   in list(admission.items())))
+
+    def on_profile(self):
+        if self.authorize is not None and not self.authorize(request):
+            raise HTTPForbidden()
+        return jsonify(self.snapshot())
@@ -0,0 +1,100 @@
+# coding=utf-8
+
+import re
+
+from .cache import LRUCache
+from .exceptions import UnknownField
+
+OPERATORS = ('eq', 'ne', 'gt', 'gte', 'lt', 'lte', 'in', 'prefix')
+SEPARATOR = '__'
+
+
+class QueryCompiler(object):
+    """Turn query string parameters into a Mongo filter and sort.
+
+    ``fields`` maps each field clients may filter on to its type and
+    allowed operators, e.g. ``{'user_id': (int, ('eq', 'in'))}``. A
+    parameter is ``field=value`` or ``field__op=value``; ``in`` takes a
+    comma separated list and ``prefix`` matches the start of a string
+    with an anchored regex, which can use an index. ``sort_fields`` are
+    the keys ``sort=-created,_id`` may use.
+
+    Parsing is compiled once per distinct set of parameter names (and
+    sort string) and memoized, so a request only converts its values.
+    A field that is not declared is rejected with UnknownField, an
+    operator or a value that is not allowed with a ValueError, so clients
+    cannot filter or sort on unindexed fields.
+    """
+
+    def __init__(self, fields, sort_fields=(), cache_size=256):
+        self.fields = fields
+        self.sort_fields = sort_fields
+        self._plans = LRUCache(cache_size)
+        self._sorts = LRUCache(cache_size)
+
+    def compile(self, names):
+        """Return the plan for a frozenset of parameter names."""
+        plan = self._plans.get(names)
+        if plan is not None:
+            return plan
+        plan = []
+        for name in sorted(names):
+            field, _, op = name.partition(SEPARATOR)
+            op = op or 'eq'
+            if field not in self.fields:
+                raise UnknownField('Cannot filter on {}.'.format(field),
+                                   field=field)
+            convert, ops = self.fields[field]
+            if op not in OPERATORS or op not in ops:
+                raise ValueError('Cannot use {0} on {1}.'.format(op, field))
+            plan.append((name, field, op, convert))
+        self._plans.set(names, plan)
+        return plan
+
+    def build_filter(self, params):
+        """Return the Mongo filter of a dict of query parameters."""
+        filter = {}
+        for name, field, op, convert in self.compile(frozenset(params)):
+            value = params[name]
+            try:
+                if op == 'in':
+                    value = [convert(item) for item in value.split(',')]
+                else:
+                    value = convert(value)
+            except (TypeError, ValueError):
+                raise ValueError('Bad value for {}.'.format(name))
+            if op == 'prefix':
+                value = {'$regex': '^' + re.escape(value)}
+            elif op != 'eq':
+                value = {'$' + op: value}
+            condition = filter.get(field)
+            if condition is None:
+                filter[field] = value
+                continue
+            # several operators on one field share a single condition.
+            if not isinstance(condition, dict) or \
+                    not all(key.startswith('$') for key in condition):
+                condition = {'$eq': condition}
+            if not isinstance(value, dict):
+                value = {'$eq': value}
+            condition.update(value)
+            filter[field] = condition
+        return filter
+
+    def build_sort(self, sort):
+        """Return the pymongo sort list of a ``-a,b`` sort parameter."""
+        if not sort:
+            return None
+        keys = self._sorts.get(sort)
+        if keys is not None:
+            return keys
+        keys = []
+        for key in sort.split(','):
+            direction = -1 if key.startswith('-') else 1
+            key = key.lstrip('-+')
+            if key not in self.sort_fields:
+                raise UnknownField('Cannot sort on {}.'.format(key),
+                                   field=key)
+            keys.append((key, direction))
+        self._sorts.set(sort, keys)
+        return keys
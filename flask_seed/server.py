@@ -0,0 +1,145 @@
+# coding=utf-8
+
+import errno
+import logging
+import os
+import signal
+import sys
+import traceback
+
+import gevent
+from gevent.baseserver import parse_address
+from gevent.pywsgi import WSGIServer, WSGIHandler
+
+
+class Handler(WSGIHandler):
+    keepalive = True
+
+    def read_request(self, raw_requestline):
+        result = super(Handler, self).read_request(raw_requestline)
+        if not self.keepalive:
+            self.close_connection = True
+        return result
+
+
+class Server(object):
+    """Serve a WSGI application with gevent's WSGIServer.
+
+    With more than one worker, the master process binds the listening
+    socket and forks the workers, which all accept on it. Workers that
+    die are replaced. SIGHUP starts a new set of workers and retires the
+    old ones, SIGTERM and SIGINT stop them all; a retired worker finishes
+    its running requests for up to graceful_timeout seconds.
+
+    max_connections caps the requests a worker handles at once, backlog
+    is the listen() queue length of the socket and keepalive = False
+    closes every connection after its response. post_fork callbacks run
+    in each worker right after fork().
+    """
+
+    def __init__(self, application, host='127.0.0.1', port=5000, workers=1,
+                 backlog=1024, max_connections=None, keepalive=True,
+                 graceful_timeout=30, post_fork=None):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.backlog = backlog
+        self.max_connections = max_connections
+        self.keepalive = keepalive
+        self.graceful_timeout = graceful_timeout
+        self.post_fork = list(post_fork or [])
+        self.listener = None
+        self.alive = True
+        self.children = set()
+        self.retired = set()
+
+    def make_server(self):
+        handler_class = type('Handler', (Handler,),
+                             dict(keepalive=self.keepalive))
+        return WSGIServer(self.listener, self.application,
+                          spawn=self.max_connections or 'default',
+                          handler_class=handler_class)
+
+    def serve(self):
+        """Serve in this process until SIGTERM."""
+        server = self.make_server()
+
+        def stop():
+            server.stop(timeout=self.graceful_timeout)
+
+        signal_handler = getattr(gevent, 'signal_handler', None) or \
+            gevent.signal
+        signal_handler(signal.SIGTERM, stop)
+        server.serve_forever()
+
+    def spawn_worker(self):
+        pid = os.fork()
+        if pid:
+            self.children.add(pid)
+            return pid
+        status = 0
+        try:
+            signal.signal(signal.SIGHUP, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            # the master turns ^C into SIGTERM for every worker.
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            gevent.reinit()
+            for callback in self.post_fork:
+                callback()
+            self.serve()
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            # os._exit skips atexit, flush the queued log records first.
+            logging.shutdown()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def kill_workers(self, pids, sig=signal.SIGTERM):
+        for pid in list(pids):
+            try:
+                os.kill(pid, sig)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+
+    def handle_restart(self, signum, frame):
+        old = set(self.children)
+        self.retired |= old
+        for _ in range(self.workers):
+            self.spawn_worker()
+        self.kill_workers(old)
+
+    def handle_stop(self, signum, frame):
+        self.alive = False
+        self.kill_workers(self.children)
+
+    def run(self):
+        family, address = parse_address((self.host, self.port))
+        self.listener = WSGIServer.get_listener(address, self.backlog, family)
+        if self.workers <= 1:
+            self.serve()
+            return
+
+        signal.signal(signal.SIGHUP, self.handle_restart)
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        for _ in range(self.workers):
+            self.spawn_worker()
+        while self.children:
+            try:
+                pid, _ = os.waitpid(-1, 0)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    break
+                raise
+            self.children.discard(pid)
+            if pid in self.retired:
+                self.retired.discard(pid)
+            elif self.alive:
+                self.spawn_worker()
+        self.listener.close()
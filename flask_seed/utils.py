@@ -1,15 +1,138 @@
 # coding=utf-8
 
-import traceback
+import base64
 from functools import wraps
 
 from bson import json_util
 from flask import request, current_app as app
 import six
 
+from .profiling import timed
 
-def dumps(data):
-    return json_util.dumps(data, default=json_util.default)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_util_dumps(data, **kwargs):
+    return json_util.dumps(data, default=json_util.default, **kwargs)
+
+
+def _orjson_default(obj):
+    try:
+        return json_util.default(obj)
+    except TypeError:
+        if hasattr(obj, '__iter__'):
+            return list(obj)
+        raise
+
+
+def _orjson_fallback(data, sort_keys=False):
+    # orjson's separators and raw UTF-8, so the output is the same.
+    return _json_util_dumps(data, sort_keys=sort_keys,
+                            separators=(',', ':'), ensure_ascii=False)
+
+
+def _orjson_dumps(data, sort_keys=False, **kwargs):
+    if kwargs:
+        return _json_util_dumps(data, sort_keys=sort_keys, **kwargs)
+    if not isinstance(data, (dict, list, tuple) + six.string_types) and \
+            hasattr(data, '__iter__'):
+        data = list(data)
+    option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    try:
+        return orjson.dumps(data, default=_orjson_default,
+                            option=option).decode('utf-8')
+    except TypeError:
+        # e.g. integers beyond 64 bits, which json_util can still encode.
+        return _orjson_fallback(data, sort_keys)
+
+
+JSON_BACKENDS = {
+    'json_util': _json_util_dumps,
+    'orjson': _orjson_dumps,
+}
+
+_dumps = _json_util_dumps
+# what dumps puts between the items of an array.
+_separator = ', '
+
+
+def set_json_backend(name):
+    """Select the encoder behind :func:`dumps`.
+
+    ``json_util`` is bson's pure Python encoder, ``orjson`` is much faster
+    and encodes BSON types through ``json_util.default`` so ObjectId,
+    datetime and Decimal128 come out the same way. It writes UUIDs as
+    plain strings though, and NaN or infinite floats as null. ``auto``
+    uses orjson when it is installed.
+    """
+    global _dumps, _separator
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'json_util'
+    if name not in JSON_BACKENDS:
+        raise ValueError('{} is not a JSON backend.'.format(name))
+    if name == 'orjson' and orjson is None:
+        raise RuntimeError('orjson is not installed.')
+    _dumps = JSON_BACKENDS[name]
+    _separator = ',' if name == 'orjson' else ', '
+
+
+def dumps(data, **kwargs):
+    return _dumps(data, **kwargs)
+
+
+def json_response(data, status=200):
+    with timed('serialize'):
+        body = dumps(data)
+    return app.response_class(body, status=status,
+                              mimetype='application/json')
+
+
+def loads(data):
+    return json_util.loads(data)
+
+
+def encode_token(data):
+    """Encode ``data`` as an opaque, URL safe token."""
+    return base64.urlsafe_b64encode(dumps(data).encode('utf-8')).decode(
+        'ascii')
+
+
+def decode_token(token):
+    """Decode a token made by :func:`encode_token`.
+
+    Raises ValueError if the token is malformed.
+    """
+    try:
+        return loads(base64.urlsafe_b64decode(str(token)).decode('utf-8'))
+    except Exception:
+        raise ValueError('Malformed token {!r}.'.format(token))
+
+
+def iterdumps(data, batch_size=100):
+    """Encode an iterable of documents as a JSON array, chunk by chunk.
+
+    The output joined together is the same as ``dumps(list(data))``, but
+    documents are encoded as they are read from ``data`` and every chunk
+    holds at most ``batch_size`` documents.
+    """
+    batch = []
+    prefix = '['
+    for doc in data:
+        batch.append(dumps(doc))
+        if len(batch) >= batch_size:
+            yield prefix + _separator.join(batch)
+            prefix = _separator
+            batch = []
+    if batch:
+        yield prefix + _separator.join(batch)
+    elif prefix == '[':
+        yield prefix
+    yield ']'
 
 
 def parse_params():
@@ -20,6 +143,27 @@ def parse_params():
     return params
 
 
+def project(doc, projection):
+    """Shape ``doc`` as a find() ``projection`` would, top level keys only.
+
+    A list names the keys to keep, a dict keeps its true keys or, if it
+    has none, drops its false ones. ``_id`` is kept unless set to a false
+    value. The result is a new dict.
+    """
+    if projection is None:
+        return doc
+    if not isinstance(projection, dict):
+        projection = dict((key, 1) for key in projection)
+    keys = [key for key, value in six.iteritems(projection)
+            if value and key != '_id']
+    if keys or (len(projection) == 1 and projection.get('_id')):
+        if projection.get('_id', 1):
+            keys.append('_id')
+        return dict((key, doc[key]) for key in keys if key in doc)
+    return dict((key, value) for key, value in six.iteritems(doc)
+                if projection.get(key, 1))
+
+
 def remove_dict_item(dict, key, default=None):
     value = default
     if key in dict:
@@ -36,22 +180,21 @@ def get_bool(value):
 
 
 def LOG(type):
+    # runs inside the request, whose app context is already pushed; the
+    # message is only formatted if a handler takes the record.
     def _log(func):
         @wraps(func)
         def __log(*args, **kwargs):
             try:
                 res = func(*args, **kwargs)
             except Exception:
-                with app.app_context():
-                    app.logger.error('{path} {type} failed. \n{reason}'.format(
-                        path=request.path, type=type,
-                        reason=traceback.format_exc()
-                    ))
+                with timed('log'):
+                    app.logger.error('%s %s failed.', request.path, type,
+                                     exc_info=True)
                 raise
             else:
-                with app.app_context():
-                    app.logger.info('{path} {type} success.'.format(
-                        path=request.path, type=type))
+                with timed('log'):
+                    app.logger.info('%s %s success.', request.path, type)
                 return res
 
         return __log
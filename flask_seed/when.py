@@ -1,10 +1,15 @@
 # coding=utf-8
 
-from datetime import date, timedelta
+import calendar
+from datetime import date, datetime, timedelta, tzinfo
 from time import time, mktime
 
+from six.moves import range
+
+from .cache import LRUCache
+
 QUARTER = {
-    1: 1, 2: 2, 3: 1, 4: 2, 5: 2, 6: 2, 7: 3, 8: 3, 9: 3, 10: 4, 11: 4, 12: 4
+    1: 1, 2: 1, 3: 1, 4: 2, 5: 2, 6: 2, 7: 3, 8: 3, 9: 3, 10: 4, 11: 4, 12: 4
 }
 
 QUARTER_MONTHS = {
@@ -14,9 +19,41 @@ QUARTER_MONTHS = {
     4: [10, 11, 12]
 }
 
+# months per bucket of the intervals counted in months.
+INTERVAL_MONTHS = {'month': 1, 'quarter': 3, 'year': 12}
+INTERVALS = ('day', 'month', 'quarter', 'year')
+
+
+class UTC(tzinfo):
+
+    def utcoffset(self, dt):
+        return timedelta(0)
+
+    def dst(self, dt):
+        return timedelta(0)
+
+    def tzname(self, dt):
+        return 'UTC'
+
+
+utc = UTC()
 
-def timestamp(day):
-    return int(mktime(day.timetuple()))
+
+def timestamp(day, tz=None):
+    """Return the timestamp of midnight at the start of ``day``.
+
+    ``tz`` is a tzinfo, pytz zones included; None means the local time of
+    the process.
+    """
+    if tz is None:
+        return int(mktime(day.timetuple()))
+    midnight = datetime(day.year, day.month, day.day)
+    localize = getattr(tz, 'localize', None)
+    if localize is not None:
+        midnight = localize(midnight)
+    else:
+        midnight = midnight.replace(tzinfo=tz)
+    return calendar.timegm(midnight.utctimetuple())
 
 
 def now():
@@ -88,7 +125,7 @@ def last_quarter():
     return timestamp(last)
 
 
-def get_month_range(year_month):
+def get_month_range(year_month, tz=None):
     year_month = year_month.split('-')
     year = int(year_month[0])
     month = int(year_month[1])
@@ -97,10 +134,10 @@ def get_month_range(year_month):
         end = date(year + 1, 1, 1)
     else:
         end = date(year, month + 1, 1)
-    return timestamp(begin), timestamp(end)
+    return timestamp(begin, tz), timestamp(end, tz)
 
 
-def get_quarter_range(year_quarter):
+def get_quarter_range(year_quarter, tz=None):
     year_quarter = year_quarter.split('#')
     year = int(year_quarter[0])
     quarter = int(year_quarter[1])
@@ -109,14 +146,14 @@ def get_quarter_range(year_quarter):
         end = date(year + 1, 1, 1)
     else:
         end = date(year, quarter * 3 + 1, 1)
-    return timestamp(begin), timestamp(end)
+    return timestamp(begin, tz), timestamp(end, tz)
 
 
-def get_year_range(year):
+def get_year_range(year, tz=None):
     year = int(year)
     begin = date(year, 1, 1)
     end = date(year + 1, 1, 1)
-    return timestamp(begin), timestamp(end)
+    return timestamp(begin, tz), timestamp(end, tz)
 
 
 YEAR = '{year}'
@@ -125,14 +162,80 @@ YEAR_QUARTER = '{year}#{quarter}'
 DAY = '{year}-{month:0>2}-{day:0>2}'
 
 
+def bucket_starts(anchor, interval, number):
+    """Return the first days of ``number`` buckets, newest first.
+
+    The first bucket holds ``anchor``; the list starts with the first day
+    of the bucket after it, so it has ``number + 1`` days and bucket ``i``
+    runs from day ``i + 1`` to day ``i``.
+    """
+    if interval == 'day':
+        return [anchor - timedelta(i) for i in range(-1, number)]
+    try:
+        step = INTERVAL_MONTHS[interval]
+    except KeyError:
+        raise ValueError('Argument interval must be '
+                         'day, month, quarter or year.')
+    first = (anchor.month - 1) // step * step
+    index = anchor.year * 12 + first
+    return [date(i // 12, i % 12 + 1, 1)
+            for i in range(index + step, index - number * step, -step)]
+
+
+def bucket_key(day, interval):
+    if interval == 'year':
+        return YEAR.format(year=day.year)
+    if interval == 'quarter':
+        return YEAR_QUARTER.format(year=day.year, quarter=QUARTER[day.month])
+    if interval == 'month':
+        return YEAR_MONTH.format(year=day.year, month=day.month)
+    return DAY.format(year=day.year, month=day.month, day=day.day)
+
+
+_buckets = LRUCache(4096)
+
+
+def recent_buckets(anchor, interval, number, tz=None):
+    """Return ``(keys, begins, ends)`` of the ``number`` buckets up to the
+    one holding ``anchor``, newest first.
+
+    Every bound is computed once, from dates, and the result is memoized
+    per ``(anchor, interval, number, tz)``; the tuples must not change.
+    """
+    cache_key = (anchor, interval, number, tz)
+    buckets = _buckets.get(cache_key)
+    if buckets is None:
+        days = bucket_starts(anchor, interval, number)
+        stamps = [timestamp(day, tz) for day in days]
+        keys = tuple(bucket_key(day, interval) for day in days[1:])
+        buckets = (keys, tuple(stamps[1:]), tuple(stamps[:-1]))
+        _buckets.set(cache_key, buckets)
+    return buckets
+
+
+def to_array(values):
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError('numpy is not installed.')
+    return numpy.array(values, dtype='int64')
+
+
 class Time(object):
-    def __init__(self, value=None):
+    def __init__(self, value=None, tz=None):
         """
         Args:
             value: can be None, Date object or (year, month, day) tuple
+            tz: tzinfo of the day boundaries, None for local time
         """
+        self.tz = tz
         if value is None:
-            self.time = date.today()
+            if tz is None:
+                self.time = date.today()
+            else:
+                self.time = datetime.now(utc).astimezone(tz).date()
+        elif isinstance(value, datetime):
+            self.time = value.date()
         elif isinstance(value, date):
             self.time = value
         elif isinstance(value, tuple) and len(value) == 3:
@@ -169,9 +272,8 @@ class Time(object):
         return self._day
 
     def day_range(self):
-        begin = timestamp(self.time)
-        end = begin + 24 * 3600
-        return begin, end
+        keys, begins, ends = recent_buckets(self.time, 'day', 1, self.tz)
+        return begins[0], ends[0]
 
     def quarter_months(self):
         months = []
@@ -194,7 +296,7 @@ class Time(object):
     def month_ago(self, number=0):
         tmp = 0
         if self.time.month <= number:
-            tmp = (number - self.time.month) / 12 + 1
+            tmp = (number - self.time.month) // 12 + 1
         return YEAR_MONTH.format(
                 year=self.time.year - tmp,
                 month=self.time.month + tmp * 12 - number
@@ -203,7 +305,7 @@ class Time(object):
     def quarter_ago(self, number=0):
         tmp = 0
         if self.quarter_number <= number:
-            tmp = (number - self.quarter_number) / 4 + 1
+            tmp = (number - self.quarter_number) // 4 + 1
         return YEAR_QUARTER.format(
                 year=self.time.year - tmp,
                 quarter=self.quarter_number + tmp * 4 - number
@@ -212,38 +314,21 @@ class Time(object):
     def year_ago(self, number=0):
         return YEAR.format(year=self.time.year - number)
 
+    def recent_bounds(self, interval, number, as_array=False):
+        """Return the begin and end timestamps of the last ``number``
+        buckets of ``interval``, newest first, as lists or, with
+        ``as_array``, NumPy arrays.
+        """
+        keys, begins, ends = recent_buckets(self.time, interval, number,
+                                            self.tz)
+        if as_array:
+            return to_array(begins), to_array(ends)
+        return list(begins), list(ends)
+
     def get_recent(self, interval, number):
-        recent = []
-        if interval == 'month':
-            for i in xrange(number):
-                recent.append(self.month_ago(i))
-        elif interval == 'quarter':
-            for i in xrange(number):
-                recent.append(self.quarter_ago(i))
-        elif interval == 'year':
-            for i in xrange(number):
-                recent.append(self.year_ago(i))
-        else:
-            raise ValueError('Argument interval must be '
-                             'month, quarter or year.')
-        return recent
+        return list(recent_buckets(self.time, interval, number, self.tz)[0])
 
     def get_recent_ranges(self, interval, number):
-        time_range = []
-        if interval == 'month':
-            for i in xrange(number):
-                month_ago = self.month_ago(i)
-                time_range.append((month_ago, get_month_range(month_ago)))
-        elif interval == 'quarter':
-            for i in xrange(number):
-                quarter_ago = self.quarter_ago(i)
-                time_range.append(
-                        (quarter_ago, get_quarter_range(quarter_ago)))
-        elif interval == 'year':
-            for i in xrange(number):
-                year_ago = self.year_ago(i)
-                time_range.append((year_ago, get_year_range(year_ago)))
-        else:
-            raise ValueError('Argument interval must be '
-                             'month, quarter or year.')
-        return time_range
+        keys, begins, ends = recent_buckets(self.time, interval, number,
+                                            self.tz)
+        return list(zip(keys, zip(begins, ends)))
@@ -29,6 +29,9 @@ setup(
         'Flask-Script',
         'gevent'
     ],
+    extras_require={
+        'sql': ['SQLAlchemy', 'Flask-SQLAlchemy'],
+    },
     classifiers=[
         'Environment :: Web Environment',
         'Intended Audience :: Developers',
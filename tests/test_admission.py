@@ -0,0 +1,105 @@
+# coding=utf-8
+
+import threading
+
+import pytest
+
+from flask_seed import admission
+from flask_seed.admission import Admission, TokenBucket
+from flask_seed.exceptions import HTTPServiceUnavailable, \
+    HTTPTooManyRequests
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admission, 'default_timer', lambda: now[0])
+    return now
+
+
+def test_token_bucket(clock):
+    bucket = TokenBucket(2, burst=2)
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert bucket.take() == pytest.approx(0.5)
+    clock[0] += 0.5
+    assert bucket.take() == 0
+    clock[0] += 10
+    # no more than burst tokens are saved up.
+    assert [bucket.take() for _ in range(3)][-1] > 0
+
+
+def test_rate_limit_is_429(clock):
+    gate = Admission(rate=0.25, burst=1)
+    gate.acquire()
+    gate.release()
+    with pytest.raises(HTTPTooManyRequests) as info:
+        gate.acquire()
+    assert info.value.status_code == 429
+    assert info.value.get_headers() == {'Retry-After': '4'}
+    assert gate.stats()['rejected_rate'] == 1
+
+
+def test_full_queue_is_503():
+    gate = Admission(max_concurrent=1, max_queue=0, retry_after=7)
+    gate.acquire()
+    with pytest.raises(HTTPServiceUnavailable) as info:
+        gate.acquire()
+    assert info.value.status_code == 503
+    assert info.value.get_headers() == {'Retry-After': '7'}
+    stats = gate.stats()
+    assert (stats['active'], stats['queued'], stats['rejected_queue']) == \
+        (1, 0, 1)
+    gate.release()
+    gate.acquire()
+    assert gate.stats()['admitted'] == 2
+
+
+def wait_for(gate, queued):
+    while gate.stats()['queued'] != queued:
+        threading.Event().wait(0.001)
+
+
+def test_release_hands_the_slot_to_the_oldest_waiter():
+    gate = Admission(max_concurrent=1, max_queue=2, queue_timeout=5)
+    gate.acquire()
+    order = []
+
+    def waiter(name):
+        gate.acquire()
+        order.append(name)
+
+    threads = []
+    for queued, name in enumerate(['first', 'second'], 1):
+        thread = threading.Thread(target=waiter, args=(name,))
+        thread.start()
+        threads.append(thread)
+        wait_for(gate, queued)
+    with pytest.raises(HTTPServiceUnavailable):
+        gate.acquire()
+    gate.release()
+    threads[0].join(5)
+    assert order == ['first']
+    assert gate.stats()['active'] == 1
+    assert gate.stats()['queued'] == 1
+    gate.release()
+    threads[1].join(5)
+    gate.release()
+    assert order == ['first', 'second']
+    stats = gate.stats()
+    assert (stats['active'], stats['queued'], stats['admitted'],
+            stats['rejected_queue']) == (0, 0, 3, 1)
+
+
+def test_queue_timeout_is_503():
+    gate = Admission(max_concurrent=1, max_queue=1, queue_timeout=0.01,
+                     retry_after=2)
+    gate.acquire()
+    with pytest.raises(HTTPServiceUnavailable) as info:
+        gate.acquire()
+    assert info.value.get_headers() == {'Retry-After': '2'}
+    stats = gate.stats()
+    assert (stats['active'], stats['queued'], stats['timed_out']) == \
+        (1, 0, 1)
+    gate.release()
+    assert gate.stats()['active'] == 0
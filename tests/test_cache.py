@@ -0,0 +1,133 @@
+# coding=utf-8
+
+import pytest
+
+from flask_seed import cache
+from flask_seed.cache import DocumentCache, LRUCache, LocalClient, \
+    SharedCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache, 'time', lambda: now[0])
+    return now
+
+
+def test_lru_evicts_least_recently_used():
+    lru = LRUCache(2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    assert lru.get('a') == 1
+    lru.set('c', 3)
+    assert lru.get('b') is None
+    assert lru.get('a') == 1
+    assert lru.get('c') == 3
+    assert len(lru) == 2
+    assert (lru.hits, lru.misses) == (3, 1)
+
+
+def test_lru_ttl(clock):
+    lru = LRUCache(10, ttl=5)
+    lru.set('a', 1)
+    lru.set('b', 2, ttl=20)
+    clock[0] += 10
+    assert lru.get('a') is None
+    assert lru.get('b') == 2
+    clock[0] += 10
+    assert lru.get('b') is None
+
+
+def test_lru_delete_and_clear():
+    lru = LRUCache(10)
+    lru['a'] = 1
+    lru.set('b', 2)
+    lru.delete('a')
+    lru.delete('missing')
+    assert lru.get('a') is None
+    lru.clear()
+    assert len(lru) == 0
+
+
+def test_shared_cache_ttl_and_delete(clock):
+    shared = SharedCache(LocalClient(), ttl=5)
+    shared.set('a', {'_id': 1, 'tags': ['x']})
+    assert shared.get('a') == {'_id': 1, 'tags': ['x']}
+    clock[0] += 10
+    assert shared.get('a') is None
+    shared.set('a', 1)
+    shared.delete('a')
+    assert shared.get('a', 'default') == 'default'
+
+
+@pytest.mark.parametrize('backend', [
+    lambda: LRUCache(10), lambda: SharedCache(LocalClient())])
+def test_document_cache_invalidation(backend):
+    documents = DocumentCache(backend())
+    loads = []
+
+    def load(doc):
+        def run():
+            loads.append(doc)
+            return dict(doc)
+        return run
+
+    doc = {'_id': 1, 'name': 'a', 'age': 3}
+    assert documents.get('users', 1, None, load(doc)) == doc
+    assert documents.get('users', 1, None, load(doc)) == doc
+    assert documents.get('users', 1, ['name'], load({'_id': 1, 'name': 'a'}))
+    assert len(loads) == 2
+    # every projection of the document goes at once.
+    documents.invalidate('users', 1)
+    documents.get('users', 1, None, load(doc))
+    documents.get('users', 1, ['name'], load({'_id': 1, 'name': 'a'}))
+    assert len(loads) == 4
+    assert documents.stats()['hits'] == 1
+
+
+def test_document_cache_returns_copies():
+    documents = DocumentCache(LRUCache(10))
+    documents.get('users', 1, None, lambda: {'_id': 1, 'tags': ['a']})
+    documents.get('users', 1, None, lambda: None)['tags'].append('b')
+    assert documents.get('users', 1, None, lambda: None) == \
+        {'_id': 1, 'tags': ['a']}
+
+
+def test_document_cache_skips_loads_racing_an_invalidation():
+    documents = DocumentCache(LRUCache(10))
+
+    def stale_load():
+        # the document is updated while it is being read.
+        documents.invalidate('users', 1)
+        return {'_id': 1, 'name': 'old'}
+
+    documents.get('users', 1, None, stale_load)
+    assert documents.get('users', 1, None,
+                         lambda: {'_id': 1, 'name': 'new'})['name'] == 'new'
+
+
+def test_model_writes_invalidate(monkeypatch):
+    mongomock = pytest.importorskip('mongomock')
+    from flask import Flask
+    from flask_seed import Seed
+    from flask_seed.drivers import MongoBase, mongo
+
+    monkeypatch.setattr(mongo, 'MongoClient', mongomock.MongoClient)
+
+    class User(MongoBase):
+        __collection__ = 'users'
+
+    app = Flask('test_cache')
+    app.config.update(SEED_DB_DRIVER='mongo', MONGO_DBNAME='test_cache',
+                      MONGO_CACHE_SIZE=10)
+    seed = Seed(app)
+    seed.register_models([User])
+    with app.app_context():
+        app.db_driver.init_db()
+        users = app.db_driver.User
+        doc_id = users.create(dict(name='a'))['_id']
+        assert users.get(doc_id)['name'] == 'a'
+        users.update(doc_id, dict(name='b'))
+        assert users.get(doc_id)['name'] == 'b'
+        users.delete(doc_id)
+        assert users.get(doc_id) is None
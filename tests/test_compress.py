@@ -0,0 +1,98 @@
+# coding=utf-8
+
+import gzip
+import zlib
+
+import pytest
+from flask import Flask, request
+
+from flask_seed.compress import Compressor
+
+BODY = b'{"name":"seed"}' * 200
+
+
+@pytest.fixture
+def app():
+    return Flask('test_compress')
+
+
+def compress(app, response, accept='gzip', method='GET', **options):
+    with app.test_request_context(method=method,
+                                  headers={'Accept-Encoding': accept}):
+        return Compressor(**options)(request, response)
+
+
+@pytest.mark.parametrize('accept, encoding', [
+    ('gzip', 'gzip'),
+    ('*', 'gzip'),
+    ('br;q=1, gzip;q=0.5', 'gzip'),
+    ('identity', None),
+    ('gzip;q=0', None),
+    ('gzip;q=0, *', None),
+    ('*;q=0', None),
+])
+def test_negotiation(app, accept, encoding):
+    with app.test_request_context(headers={'Accept-Encoding': accept}):
+        assert Compressor().negotiate(request) == encoding
+
+
+def test_compresses_with_vary_and_weak_etag(app):
+    response = app.response_class(BODY, mimetype='application/json')
+    response.set_etag('v1')
+    response = compress(app, response)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+    assert response.get_etag() == ('v1', True)
+    assert gzip.decompress(response.get_data()) == BODY
+    assert int(response.headers['Content-Length']) < len(BODY)
+
+
+@pytest.mark.parametrize('body, accept, mimetype, method', [
+    (BODY[:100], 'gzip', 'application/json', 'GET'),
+    (BODY, 'identity', 'application/json', 'GET'),
+    (BODY, 'gzip;q=0', 'application/json', 'GET'),
+    (BODY, 'gzip', 'image/png', 'GET'),
+    (BODY, 'gzip', 'application/json', 'HEAD'),
+])
+def test_left_as_is(app, body, accept, mimetype, method):
+    response = app.response_class(body, mimetype=mimetype)
+    response.set_etag('v1')
+    response = compress(app, response, accept, method)
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_etag() == ('v1', False)
+    assert response.get_data() == body
+    if mimetype == 'application/json' and method == 'GET':
+        # the identity body still depends on Accept-Encoding.
+        assert 'Accept-Encoding' in response.vary
+
+
+def test_streams_flush_every_chunk(app):
+    chunks = [BODY[:600], BODY[600:1200], BODY[1200:]]
+    sent = []
+
+    def generate():
+        for chunk in chunks:
+            sent.append(chunk)
+            yield chunk
+
+    response = app.response_class(generate(), mimetype='application/json')
+    response = compress(app, response)
+    assert response.is_streamed
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    iterator = iter(response.response)
+    # the first two chunks are read to reach min_size, then one by one.
+    assert decoder.decompress(next(iterator)) == chunks[0] + chunks[1]
+    assert len(sent) == 2
+    assert decoder.decompress(next(iterator)) == chunks[2]
+    assert decoder.decompress(b''.join(iterator)) == b''
+    assert decoder.eof
+
+
+def test_small_streams_are_sent_whole(app):
+    response = app.response_class(iter([b'[', b'1', b']']),
+                                  mimetype='application/json')
+    response = compress(app, response)
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_data() == b'[1]'
@@ -0,0 +1,154 @@
+# coding=utf-8
+
+import gevent
+import pytest
+from flask import Flask, g
+
+from flask_seed import expand
+from flask_seed.expand import Expander, expanded_key
+
+
+class Model(object):
+
+    def __init__(self, name, docs, dbref=None):
+        self.name = name
+        self.docs = dict((doc['_id'], doc) for doc in docs)
+        self.dbref = dbref or {}
+        self.calls = []
+
+    def get_many(self, ids, projection=None):
+        self.calls.append((sorted(ids), projection, gevent.getcurrent()))
+        docs = {}
+        for _id in ids:
+            if _id in self.docs:
+                doc = self.docs[_id]
+                if projection:
+                    doc = dict((key, doc[key]) for key in doc
+                               if key == '_id' or key in projection)
+                docs[_id] = dict(doc)
+        return docs
+
+
+class Driver(object):
+
+    def __init__(self, *models):
+        for model in models:
+            setattr(self, model.name, model)
+
+
+@pytest.fixture
+def driver():
+    org = Model('Org', [{'_id': 1, 'name': 'o1'}])
+    user = Model('User', [{'_id': i, 'name': 'u{}'.format(i), 'org_id': 1}
+                          for i in range(1, 4)], {'org_id': 'Org'})
+    tag = Model('Tag', [{'_id': 'a'}, {'_id': 'b'}])
+    order = Model('Order', [], {'user_id': 'User', 'buyer_id': 'User',
+                                'tag_ids': 'Tag'})
+    return Driver(org, user, tag, order)
+
+
+def orders():
+    return [{'_id': 1, 'user_id': 1, 'buyer_id': 2, 'tag_ids': ['a', 'x']},
+            {'_id': 2, 'user_id': 9, 'buyer_id': 1, 'tag_ids': []},
+            {'_id': 3, 'user_id': None}]
+
+
+def test_expanded_key():
+    assert expanded_key('user_id') == 'user'
+    assert expanded_key('_id') == '_id_ref'
+    assert expanded_key('tags') == 'tags_ref'
+
+
+def test_expands_in_one_query_per_model(driver):
+    expander = Expander(driver, driver.Order, max_depth=2)
+    docs = expander.expand(orders(), expander.parse(
+        'user_id.org_id,buyer_id,tag_ids'))
+    assert docs[0]['user'] == {'_id': 1, 'name': 'u1', 'org_id': 1,
+                               'org': {'_id': 1, 'name': 'o1'}}
+    assert docs[0]['buyer']['name'] == 'u2'
+    assert 'org' not in docs[0]['buyer']
+    assert docs[0]['tag_ids_ref'] == [{'_id': 'a'}, None]
+    assert docs[1]['user'] is None
+    assert docs[1]['tag_ids_ref'] == []
+    assert docs[2]['user'] is None
+    assert [call[0] for call in driver.User.calls] == [[1, 2, 9]]
+    assert [call[0] for call in driver.Org.calls] == [[1]]
+
+
+def test_depth_limit(driver):
+    expander = Expander(driver, driver.Order, max_depth=1)
+    with pytest.raises(ValueError, match='more than 1 levels'):
+        expander.parse('user_id.org_id')
+    with pytest.raises(ValueError, match='Cannot expand name'):
+        expander.parse('name')
+    assert expander.parse('user_id,,tag_ids') == {'user_id': {},
+                                                  'tag_ids': {}}
+
+
+def test_id_limit(driver):
+    expander = Expander(driver, driver.Order, max_ids=2)
+    with pytest.raises(ValueError, match='more than 2 User'):
+        expander.expand(orders(), expander.parse('user_id,buyer_id'))
+    assert expander.expand(orders(), expander.parse('user_id'))
+
+
+def test_projections(driver):
+    expander = Expander(driver, driver.Order, max_depth=2,
+                        projections={'user_id': ['name'],
+                                     'buyer_id': ['name']})
+    docs = expander.expand(orders(), expander.parse(
+        'user_id.org_id,buyer_id'))
+    # the org_id reference below is read even if not projected.
+    assert docs[0]['user'] == {'_id': 1, 'name': 'u1', 'org_id': 1,
+                               'org': {'_id': 1, 'name': 'o1'}}
+    assert docs[0]['buyer'] == {'_id': 2, 'name': 'u2'}
+    projections = sorted(call[1] for call in driver.User.calls)
+    assert projections == [('name',), ('name', 'org_id')]
+
+
+@pytest.fixture
+def patched(monkeypatch):
+    patched = [True]
+    monkeypatch.setattr(expand.monkey, 'is_module_patched',
+                        lambda name: patched[0])
+    return patched
+
+
+def lookup_greenlets(driver):
+    return set(call[2] for name in ('User', 'Tag')
+               for call in getattr(driver, name).calls)
+
+
+def test_sequential_without_patched_sockets(driver, patched):
+    patched[0] = False
+    expander = Expander(driver, driver.Order)
+    assert not expander.concurrent_io()
+    expander.expand(orders(), expander.parse('user_id,tag_ids'))
+    assert lookup_greenlets(driver) == {gevent.getcurrent()}
+
+
+def test_sequential_when_disabled(driver, patched):
+    expander = Expander(driver, driver.Order, concurrent=False)
+    assert not expander.concurrent_io()
+
+
+def test_sequential_with_read_your_writes(driver, patched):
+    expander = Expander(driver, driver.Order)
+    app = Flask('test_expand')
+    with app.test_request_context():
+        assert expander.concurrent_io()
+        g.seed_read_your_writes = True
+        assert not expander.concurrent_io()
+        expander.expand(orders(), expander.parse('user_id,tag_ids'))
+    assert lookup_greenlets(driver) == {gevent.getcurrent()}
+
+
+def test_concurrent_with_patched_sockets(driver, patched):
+    expander = Expander(driver, driver.Order)
+    app = Flask('test_expand')
+    with app.test_request_context():
+        docs = expander.expand(orders(), expander.parse('user_id,tag_ids'))
+    assert docs[0]['user']['name'] == 'u1'
+    greenlets = lookup_greenlets(driver)
+    assert len(greenlets) == 2
+    assert gevent.getcurrent() not in greenlets
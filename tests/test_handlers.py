@@ -0,0 +1,143 @@
+# coding=utf-8
+
+import pytest
+from flask import Flask
+
+mongomock = pytest.importorskip('mongomock')
+
+from flask_seed import Seed, BaseHandler  # noqa: E402
+from flask_seed.drivers import MongoBase, mongo  # noqa: E402
+from flask_seed.utils import encode_token  # noqa: E402
+
+
+class User(MongoBase):
+    __collection__ = 'users'
+
+
+class TrackedUser(User):
+    track_changes = True
+
+
+@pytest.fixture
+def make_client(monkeypatch):
+    monkeypatch.setattr(mongo, 'MongoClient', mongomock.MongoClient)
+
+    def make(model=User, **handler_attrs):
+        app = Flask('test_handlers')
+        app.config.update(SEED_DB_DRIVER='mongo', MONGO_DBNAME='test_handlers')
+        seed = Seed(app)
+        seed.register_models([model])
+        with app.app_context():
+            app.db_driver.init_db()
+        handler = type('UserHandler', (BaseHandler,),
+                       dict(model=model.__name__, member='user',
+                            **handler_attrs))
+        seed.register_handlers([handler])
+        return app.test_client()
+    return make
+
+
+def test_list_projection_drops_keys(make_client):
+    client = make_client(response_projection=['password'])
+    response = client.post('/users', json={'name': 'a', 'password': 'x'})
+    assert response.status_code == 201
+    assert response.get_json() == {'_id': 1, 'name': 'a'}
+    response = client.post('/users/1', json={'name': 'b'})
+    assert response.status_code == 200
+    assert 'password' not in response.get_json()
+    assert response.get_json()['name'] == 'b'
+
+
+def test_member_url_takes_int_ids(make_client):
+    client = make_client()
+    client.post('/users', json={'name': 'a'})
+    assert client.get('/users/1').get_json()['name'] == 'a'
+    assert client.get('/users/bulk').status_code == 405
+    assert client.get('/users/buckets').status_code == 404
+    assert client.get('/users/x').status_code == 404
+
+
+def test_collection_etag(make_client):
+    client = make_client(TrackedUser, etag=True)
+    client.post('/users', json={'name': 'a'})
+    etag = client.get('/users').headers['ETag']
+    response = client.get('/users', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    client.post('/users', json={'name': 'b'})
+    response = client.get('/users', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert len(response.get_json()) == 2
+
+
+def test_no_collection_etag_from_secondaries(make_client):
+    client = make_client(TrackedUser, etag=True,
+                         read_preference='SECONDARY_PREFERRED')
+    client.post('/users', json={'name': 'a'})
+    assert 'ETag' not in client.get('/users').headers
+
+
+def pages(client, url):
+    names, after = [], None
+    while True:
+        response = client.get(url + ('&after=' + after if after else ''))
+        assert response.status_code == 200
+        names.append([doc.get('name') for doc in response.get_json()])
+        after = response.headers.get('Next-After')
+        if after is None:
+            return names
+
+
+def test_keyset_pages(make_client):
+    client = make_client(keyset_pagination=True)
+    for i in range(5):
+        client.post('/users', json={'name': 'u{}'.format(i)})
+    assert pages(client, '/users?limit=2') == [
+        ['u0', 'u1'], ['u2', 'u3'], ['u4']]
+    # the last page has no Next-After, even when it is full.
+    assert pages(client, '/users?limit=5') == [
+        ['u0', 'u1', 'u2', 'u3', 'u4']]
+
+
+def test_keyset_pages_over_null_keys(make_client):
+    client = make_client(keyset_pagination=True, keyset_field='name')
+    for name in ['b', None, 'a', None, 'c']:
+        doc = {'age': 1}
+        if name is not None:
+            doc['name'] = name
+        client.post('/users', json=doc)
+    client.post('/users', json={'name': None})
+    assert pages(client, '/users?limit=2') == [
+        [None, None], [None, 'a'], ['b', 'c']]
+
+
+@pytest.mark.parametrize('after', [
+    'not a token', encode_token(['a']), encode_token([{'$gt': ''}, 1]),
+    encode_token(['a', '1']), encode_token(['a', True]),
+    encode_token({'name': 'a', '_id': 1})])
+def test_keyset_bad_tokens(make_client, after):
+    client = make_client(keyset_pagination=True, keyset_field='name')
+    client.post('/users', json={'name': 'a'})
+    response = client.get('/users', query_string={'after': after})
+    assert response.status_code == 400
+
+
+def test_filter_fields(make_client):
+    client = make_client(filter_fields={'age': (int, ('eq', 'gt'))},
+                         sort_fields=['age'])
+    for age in range(3):
+        client.post('/users', json={'name': str(age), 'age': age})
+    response = client.get('/users?age__gt=0&sort=-age')
+    assert [doc['age'] for doc in response.get_json()] == [2, 1]
+    for url in ['/users?name=a', '/users?age__lt=1', '/users?age=x',
+                '/users?sort=name']:
+        response = client.get(url)
+        assert response.status_code == 400
+        assert response.get_json()['message']
+
+
+def test_rate_limit(make_client):
+    client = make_client(rate_limit=0.5, rate_burst=1)
+    assert client.get('/users').status_code == 200
+    response = client.get('/users')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '2'
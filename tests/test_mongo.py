@@ -0,0 +1,91 @@
+# coding=utf-8
+
+import pytest
+from flask import Flask
+from pymongo import IndexModel
+
+mongomock = pytest.importorskip('mongomock')
+
+from flask_seed import Seed  # noqa: E402
+from flask_seed.drivers import mongo  # noqa: E402
+from flask_seed.drivers.mongo import IndexBuild  # noqa: E402
+
+
+def test_index_build_survives_progress_errors():
+    db = mongomock.MongoClient().db
+    calls = []
+
+    def progress(collection, diff, done, total):
+        calls.append((collection, done, total))
+        raise RuntimeError('progress')
+
+    build = IndexBuild(db, {'a': [IndexModel('x')], 'b': [IndexModel('y')]},
+                       workers=1, progress=progress, on_done=calls.append)
+    assert build.start().join(5).done
+    assert calls == [('a', 1, 2), ('b', 2, 2), build]
+    assert sorted(build.report) == ['a', 'b']
+    assert build.report['a']['missing'] == ['x_1']
+
+
+@pytest.fixture
+def make_driver(monkeypatch):
+    monkeypatch.setattr(mongo, 'MongoClient', mongomock.MongoClient)
+
+    def make(**config):
+        app = Flask('test_mongo')
+        app.config.update(SEED_DB_DRIVER='mongo', MONGO_DBNAME='test_mongo')
+        app.config.update(config)
+        Seed(app)
+        return app.db_driver
+    return make
+
+
+@pytest.fixture
+def day(monkeypatch):
+    today = ['20161018']
+    monkeypatch.setattr(mongo, 'strftime', lambda format: today[0])
+    return today
+
+
+def test_serial_numbers_count_per_day(make_driver, day):
+    driver = make_driver()
+    assert driver.get_serial_numbers(2) == ['201610180001', '201610180002']
+    assert driver.get_serial_number() == '201610180003'
+    day[0] = '20161019'
+    assert driver.get_serial_numbers(2) == ['201610190001', '201610190002']
+    counters = dict((doc['name'], doc['id']) for doc in driver.db.ids.find())
+    assert counters == {'todo_serial_number:20161018': 3,
+                        'todo_serial_number:20161019': 2}
+
+
+def test_serial_numbers_start_after_legacy(make_driver, day):
+    driver = make_driver()
+    driver.db.ids.insert_one(dict(name='todo_serial_number',
+                                  today='20161018', id=41))
+    assert driver.get_serial_number() == '201610180042'
+    # the legacy counter of another day is ignored.
+    day[0] = '20161019'
+    assert driver.get_serial_number() == '201610190001'
+    driver.db.ids.insert_one(dict(name='todo_serial_number:20161020',
+                                  id=9998))
+    day[0] = '20161020'
+    # past 9999 the number simply grows a digit.
+    assert driver.get_serial_numbers(2) == ['201610209999',
+                                            '2016102010000']
+
+
+def test_serial_blocks_end_with_the_day(make_driver, day):
+    driver = make_driver(MONGO_SERIAL_BLOCK_SIZE=10)
+    first = driver.get_serial_numbers(3)
+    assert first == ['201610180001', '201610180002', '201610180003']
+    assert driver.db.ids.find_one(
+        dict(name='todo_serial_number:20161018'))['id'] == 10
+    day[0] = '20161019'
+    # the rest of yesterday's block is not handed out today.
+    second = driver.get_serial_numbers(12)
+    assert second[0] == '201610190001'
+    assert second[-1] == '201610190012'
+    serials = first + second + driver.get_serial_numbers(20)
+    assert len(set(serials)) == len(serials)
+    assert all(len(serial) == 12 and serial.isdigit() for serial in serials)
+    assert [serial[:8] for serial in serials].count('20161018') == 3
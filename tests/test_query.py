@@ -0,0 +1,67 @@
+# coding=utf-8
+
+import pytest
+
+from flask_seed.exceptions import UnknownField
+from flask_seed.query import QueryCompiler
+
+FIELDS = {
+    'user_id': (int, ('eq', 'ne', 'in')),
+    'created': (int, ('gt', 'gte', 'lt', 'lte')),
+    'name': (str, ('eq', 'prefix')),
+}
+
+
+@pytest.fixture
+def compiler():
+    return QueryCompiler(FIELDS, sort_fields=('created', '_id'))
+
+
+@pytest.mark.parametrize('params, expected', [
+    ({'user_id': '3'}, {'user_id': 3}),
+    ({'user_id__eq': '3'}, {'user_id': 3}),
+    ({'user_id__ne': '3'}, {'user_id': {'$ne': 3}}),
+    ({'user_id__in': '1,2'}, {'user_id': {'$in': [1, 2]}}),
+    ({'created__gt': '1'}, {'created': {'$gt': 1}}),
+    ({'created__gte': '1'}, {'created': {'$gte': 1}}),
+    ({'created__lt': '1'}, {'created': {'$lt': 1}}),
+    ({'created__lte': '1'}, {'created': {'$lte': 1}}),
+    ({'name__prefix': 'a.b'}, {'name': {'$regex': r'^a\.b'}}),
+    ({'created__gte': '1', 'created__lt': '5'},
+     {'created': {'$gte': 1, '$lt': 5}}),
+    ({'user_id': '1', 'user_id__ne': '2'},
+     {'user_id': {'$eq': 1, '$ne': 2}}),
+])
+def test_operators(compiler, params, expected):
+    assert compiler.build_filter(params) == expected
+    # the memoized plan gives the same filter.
+    assert compiler.build_filter(params) == expected
+
+
+@pytest.mark.parametrize('params', [
+    {'age': '1'}, {'age__gt': '1'}, {'created__gt': '1', 'password': 'x'}])
+def test_unknown_fields(compiler, params):
+    with pytest.raises(UnknownField):
+        compiler.build_filter(params)
+
+
+@pytest.mark.parametrize('params', [
+    {'user_id__gt': '1'}, {'name__in': 'a'}, {'name__regex': 'a'}])
+def test_operators_not_allowed(compiler, params):
+    with pytest.raises(ValueError, match='Cannot use'):
+        compiler.build_filter(params)
+
+
+@pytest.mark.parametrize('params', [
+    {'user_id': 'x'}, {'user_id__in': '1,x'}, {'created__gt': ''}])
+def test_bad_values(compiler, params):
+    with pytest.raises(ValueError, match='Bad value'):
+        compiler.build_filter(params)
+
+
+def test_sort(compiler):
+    assert compiler.build_sort('-created,_id') == [('created', -1),
+                                                   ('_id', 1)]
+    assert compiler.build_sort('') is None
+    with pytest.raises(UnknownField):
+        compiler.build_sort('-name')
@@ -0,0 +1,133 @@
+# coding=utf-8
+
+import pytest
+from flask import Flask
+
+sqlalchemy = pytest.importorskip('sqlalchemy')
+pytest.importorskip('flask_sqlalchemy')
+
+from sqlalchemy import Column, Integer, String  # noqa: E402
+
+from flask_seed import Seed, BaseHandler  # noqa: E402
+from flask_seed.drivers import SQLBase  # noqa: E402
+
+
+class Customer(SQLBase):
+    __tablename__ = 'customers'
+    columns = [
+        Column('name', String(64), nullable=False),
+        Column('user_id', Integer, index=True),
+        Column('created', Integer),
+        Column('total', Integer),
+        Column('version', Integer),
+    ]
+    version_field = 'version'
+
+
+class CustomerHandler(BaseHandler):
+    model = 'Customer'
+    member = 'customer'
+    bucket_fields = ['created']
+    bucket_value_fields = ['total']
+    read_preference = 'SECONDARY_PREFERRED'
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask('test_sql')
+    app.config.update(SEED_DB_DRIVER='sql',
+                      SQL_URI='sqlite:///{}'.format(tmp_path / 'seed.db'),
+                      SQL_ID_BLOCK_SIZE=10)
+    seed = Seed(app)
+    seed.register_models([Customer])
+    with app.app_context():
+        app.db_driver.init_db()
+    seed.register_handlers([CustomerHandler])
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def create(client, **doc):
+    response = client.post('/customers', json=doc)
+    assert response.status_code == 201
+    return response.get_json()
+
+
+def test_crud(client):
+    for i in range(5):
+        create(client, name='c{}'.format(i), user_id=i % 2)
+    response = client.get('/customers?user_id=1')
+    assert response.headers['Total'] == '2'
+    assert [doc['name'] for doc in response.get_json()] == ['c1', 'c3']
+    assert client.get('/customers/2?columns=name').get_json() == \
+        {'_id': 2, 'name': 'c1'}
+    assert client.post('/customers/2', json={'name': 'two'}).get_json()[
+        'version'] == 1
+    assert client.post('/customers/99', json={'name': 'x'}).status_code == \
+        404
+    assert client.delete('/customers/2').status_code == 204
+    assert client.get('/customers/2').status_code == 404
+
+
+def test_unknown_column_is_bad_request(client):
+    response = client.post('/customers', json={'name': 'a', 'nope': 1})
+    assert response.status_code == 400
+    assert 'nope' in response.get_json()['message']
+    create(client, name='a')
+    assert client.post('/customers/1', json={'nope': 1}).status_code == 400
+
+
+def test_bulk(client):
+    response = client.post('/customers/bulk', json=[
+        {'name': 'b1'}, {'name': None}, {'name': 'b3'}])
+    results = response.get_json()
+    assert [result['ok'] for result in results] == [True, False, True]
+    response = client.put('/customers/bulk', json=[
+        {'_id': results[0]['_id'], 'name': 'one'}, {'_id': 99, 'name': 'z'}])
+    assert [result['ok'] for result in response.get_json()] == [True, False]
+    response = client.delete('/customers/bulk',
+                             json=[results[0]['_id'], 98])
+    assert [result['ok'] for result in response.get_json()] == [True, False]
+
+
+def test_filters(app):
+    with app.app_context():
+        model = app.db_driver.Customer
+        for name, user_id in (('ca', 1), ('cb', None), ('da', 7)):
+            model.create(dict(name=name, user_id=user_id))
+        assert model.count({'$or': [{'name': {'$regex': '^c'}},
+                                    {'user_id': {'$in': [7]}}]}) == 3
+        assert model.count({'user_id': {'$exists': False}}) == 1
+        docs = list(model.query({'name': {'$gte': 'c'}},
+                                sort=[('name', -1)], projection=['name']))
+        assert [doc['name'] for doc in docs] == ['da', 'cb', 'ca']
+        assert model.query().limit(2).skip(2).count(
+            with_limit_and_skip=True) == 1
+        with pytest.raises(ValueError):
+            model.count({'nope': 1})
+        with pytest.raises(ValueError):
+            model.count({'name': {'$regex': 'a.*'}})
+
+
+def test_bucket_totals(app):
+    with app.app_context():
+        model = app.db_driver.Customer
+        for created, total in ((0, 1), (5, 2), (10, 4), (25, 8)):
+            model.create(dict(name='c', created=created, total=total))
+        totals = model.bucket_totals('created', [0, 10, 20, 30], None,
+                                     'total', 'sum')
+        assert totals == {0: {'count': 2, 'sum': 3},
+                          10: {'count': 1, 'sum': 4},
+                          20: {'count': 1, 'sum': 8}}
+        assert model.with_options(read_preference='SECONDARY') is model
+
+
+def test_buckets_route(client):
+    response = client.get('/customers/buckets?interval=day&number=2'
+                          '&field=created&sum=total')
+    assert response.status_code == 200
+    assert [bucket['count'] for bucket in response.get_json()] == [0, 0]
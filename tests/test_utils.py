@@ -0,0 +1,32 @@
+# coding=utf-8
+
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+
+from flask_seed import utils
+
+orjson = pytest.importorskip('orjson')
+
+
+@pytest.mark.parametrize('data', [
+    {'_id': ObjectId('5f1d7f3e2b1c4a0011223344')},
+    {'created': datetime(2020, 1, 2, 3, 4, 5, 678000)},
+    {'total': Decimal128('1.10')},
+    [{'_id': 1, 'user': {'_id': ObjectId('5f1d7f3e2b1c4a0011223344'),
+                         'seen': [datetime(2021, 6, 1), None, 1.5]},
+      'tags': ('a', u'\xe9'), 'big': 2 ** 70}],
+])
+def test_orjson_matches_json_util(data):
+    expected = utils._orjson_fallback(data)
+    assert utils._orjson_dumps(data) == expected
+    assert utils._orjson_dumps(data, sort_keys=True) == \
+        utils._orjson_fallback(data, sort_keys=True)
+
+
+def test_orjson_encodes_iterables():
+    data = {'ids': set([1])}
+    assert utils._orjson_dumps(data) == '{"ids":[1]}'
+    assert utils._orjson_dumps(iter([{'a': 1}])) == '[{"a":1}]'
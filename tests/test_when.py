@@ -0,0 +1,102 @@
+# coding=utf-8
+
+import calendar
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from flask_seed import when
+from flask_seed.when import Time, bucket_starts, recent_buckets, utc
+
+SHANGHAI = timezone(timedelta(hours=8))
+
+
+def midnight(year, month, day, hours=0):
+    # the UTC timestamp of a midnight ``hours`` ahead of UTC.
+    return calendar.timegm((year, month, day, 0, 0, 0)) - hours * 3600
+
+
+def test_quarter_table():
+    assert [when.QUARTER[month] for month in range(1, 13)] == \
+        [1, 1, 1, 2, 2, 2, 3, 3, 3, 4, 4, 4]
+    for quarter, months in when.QUARTER_MONTHS.items():
+        assert set(when.QUARTER[month] for month in months) == {quarter}
+
+
+@pytest.mark.parametrize('interval, expected', [
+    ('day', [date(2016, 3, 2), date(2016, 3, 1), date(2016, 2, 29),
+             date(2016, 2, 28)]),
+    ('month', [date(2016, 4, 1), date(2016, 3, 1), date(2016, 2, 1),
+               date(2016, 1, 1)]),
+    ('quarter', [date(2016, 4, 1), date(2016, 1, 1), date(2015, 10, 1),
+                 date(2015, 7, 1)]),
+    ('year', [date(2017, 1, 1), date(2016, 1, 1), date(2015, 1, 1),
+              date(2014, 1, 1)]),
+])
+def test_bucket_starts(interval, expected):
+    assert bucket_starts(date(2016, 3, 1), interval, 3) == expected
+
+
+@pytest.mark.parametrize('anchor, first', [
+    (date(2016, 2, 15), '2016#1'), (date(2016, 3, 31), '2016#1'),
+    (date(2016, 4, 1), '2016#2'), (date(2016, 12, 31), '2016#4')])
+def test_quarter_buckets(anchor, first):
+    keys, begins, ends = recent_buckets(anchor, 'quarter', 1, utc)
+    assert keys == (first,)
+    quarter = int(first[-1])
+    assert begins[0] == midnight(2016, quarter * 3 - 2, 1)
+
+
+def test_bucket_starts_rejects_other_intervals():
+    with pytest.raises(ValueError):
+        bucket_starts(date(2016, 3, 1), 'week', 2)
+
+
+def test_recent_buckets():
+    keys, begins, ends = recent_buckets(date(2016, 1, 20), 'month', 3, utc)
+    assert keys == ('2016-01', '2015-12', '2015-11')
+    assert begins == (midnight(2016, 1, 1), midnight(2015, 12, 1),
+                      midnight(2015, 11, 1))
+    assert ends == (midnight(2016, 2, 1),) + begins[:-1]
+    # memoized: the same tuples come back.
+    assert recent_buckets(date(2016, 1, 20), 'month', 3, utc)[1] is begins
+
+
+def test_recent_buckets_in_a_timezone():
+    keys, begins, ends = recent_buckets(date(2016, 1, 1), 'day', 2,
+                                        SHANGHAI)
+    assert keys == ('2016-01-01', '2015-12-31')
+    assert begins == (midnight(2016, 1, 1, 8), midnight(2015, 12, 31, 8))
+    assert ends[0] == midnight(2016, 1, 2, 8)
+
+
+class Localized(object):
+    """A pytz like zone, which must localize rather than replace."""
+
+    def localize(self, dt):
+        return dt.replace(tzinfo=SHANGHAI)
+
+
+def test_timestamp():
+    day = date(2016, 10, 18)
+    assert when.timestamp(day, utc) == midnight(2016, 10, 18)
+    assert when.timestamp(day, SHANGHAI) == midnight(2016, 10, 18, 8)
+    assert when.timestamp(day, Localized()) == midnight(2016, 10, 18, 8)
+    local = datetime(2016, 10, 18)
+    assert when.timestamp(day) == int(local.timestamp())
+
+
+def test_time_ranges():
+    time = Time((2016, 2, 10), tz=utc)
+    assert time.quarter == '2016#1'
+    assert time.day_range() == (midnight(2016, 2, 10),
+                                midnight(2016, 2, 11))
+    assert time.get_recent('quarter', 2) == ['2016#1', '2015#4']
+    assert time.get_recent_ranges('year', 1) == [
+        ('2016', (midnight(2016, 1, 1), midnight(2017, 1, 1)))]
+    begins, ends = time.recent_bounds('month', 2)
+    assert begins == [midnight(2016, 2, 1), midnight(2016, 1, 1)]
+    assert when.get_quarter_range('2016#1', utc) == (
+        midnight(2016, 1, 1), midnight(2016, 4, 1))
+    assert when.get_month_range('2016-12', utc) == (
+        midnight(2016, 12, 1), midnight(2017, 1, 1))